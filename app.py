@@ -4,17 +4,55 @@ Aplicativo Desktop para Windows
 """
 
 import os
+import sys
+import random
 import json
+import codecs
+import mmap
+import struct
+import sqlite3
+import zlib
+import gzip
+import hashlib
+import multiprocessing
+import click
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 import re
+import bisect
+import time
+import heapq
+import math
+import tempfile
+import threading
+from array import array
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 from flask import Flask, render_template, jsonify, request
 
+try:
+    import brotli  # opcional: respostas em br além de gzip
+except ImportError:
+    brotli = None
+
 app = Flask(__name__)
 
 BASE_STATS_URL = "https://www.smogon.com/stats"
 
 # Chave da API Gemini (opcional - para análise de times)
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
+# Backend das análises de time: 'gemini' ou 'local' (resposta simulada, para testes offline)
+ANALYSIS_BACKEND = os.environ.get('POKESTATS_ANALYSIS_BACKEND', 'gemini')
+ANALYSIS_CONCURRENCY = int(os.environ.get('POKESTATS_ANALYSIS_CONCURRENCY', '2'))
+
+# Cache local dos arquivos do Smogon (disco + memória)
+CACHE_DIR = os.environ.get('POKESTATS_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+CHAOS_MEMORY_BUDGET = int(os.environ.get('POKESTATS_CHAOS_CACHE_MB', '128')) * 1024 * 1024
+CHAOS_REVALIDATE_SECONDS = 60 * 60
+# Respostas JSON já serializadas e comprimidas (ver json_response)
+RESPONSE_MEMORY_BUDGET = int(os.environ.get('POKESTATS_RESPONSE_CACHE_MB', '32')) * 1024 * 1024
 
 # ==================== TODOS OS FORMATOS DO SHOWDOWN ====================
 
@@ -253,93 +291,57 @@ NATURES = [
     'Rash', 'Relaxed', 'Sassy', 'Serious', 'Timid'
 ]
 
-# Tabela de efetividade de tipos (atacante -> defensor)
-TYPE_EFFECTIVENESS = {
-    'Normal': {'Rock': 0.5, 'Ghost': 0, 'Steel': 0.5},
-    'Fire': {'Fire': 0.5, 'Water': 0.5, 'Grass': 2, 'Ice': 2, 'Bug': 2, 'Rock': 0.5, 'Dragon': 0.5, 'Steel': 2},
-    'Water': {'Fire': 2, 'Water': 0.5, 'Grass': 0.5, 'Ground': 2, 'Rock': 2, 'Dragon': 0.5},
-    'Electric': {'Water': 2, 'Electric': 0.5, 'Grass': 0.5, 'Ground': 0, 'Flying': 2, 'Dragon': 0.5},
-    'Grass': {'Fire': 0.5, 'Water': 2, 'Grass': 0.5, 'Poison': 0.5, 'Ground': 2, 'Flying': 0.5, 'Bug': 0.5, 'Rock': 2, 'Dragon': 0.5, 'Steel': 0.5},
-    'Ice': {'Fire': 0.5, 'Water': 0.5, 'Grass': 2, 'Ice': 0.5, 'Ground': 2, 'Flying': 2, 'Dragon': 2, 'Steel': 0.5},
-    'Fighting': {'Normal': 2, 'Ice': 2, 'Poison': 0.5, 'Flying': 0.5, 'Psychic': 0.5, 'Bug': 0.5, 'Rock': 2, 'Ghost': 0, 'Dark': 2, 'Steel': 2, 'Fairy': 0.5},
-    'Poison': {'Grass': 2, 'Poison': 0.5, 'Ground': 0.5, 'Rock': 0.5, 'Ghost': 0.5, 'Steel': 0, 'Fairy': 2},
-    'Ground': {'Fire': 2, 'Electric': 2, 'Grass': 0.5, 'Poison': 2, 'Flying': 0, 'Bug': 0.5, 'Rock': 2, 'Steel': 2},
-    'Flying': {'Electric': 0.5, 'Grass': 2, 'Fighting': 2, 'Bug': 2, 'Rock': 0.5, 'Steel': 0.5},
-    'Psychic': {'Fighting': 2, 'Poison': 2, 'Psychic': 0.5, 'Dark': 0, 'Steel': 0.5},
-    'Bug': {'Fire': 0.5, 'Grass': 2, 'Fighting': 0.5, 'Poison': 0.5, 'Flying': 0.5, 'Psychic': 2, 'Ghost': 0.5, 'Dark': 2, 'Steel': 0.5, 'Fairy': 0.5},
-    'Rock': {'Fire': 2, 'Ice': 2, 'Fighting': 0.5, 'Ground': 0.5, 'Flying': 2, 'Bug': 2, 'Steel': 0.5},
-    'Ghost': {'Normal': 0, 'Psychic': 2, 'Ghost': 2, 'Dark': 0.5},
-    'Dragon': {'Dragon': 2, 'Steel': 0.5, 'Fairy': 0},
-    'Dark': {'Fighting': 0.5, 'Psychic': 2, 'Ghost': 2, 'Dark': 0.5, 'Fairy': 0.5},
-    'Steel': {'Fire': 0.5, 'Water': 0.5, 'Electric': 0.5, 'Ice': 2, 'Rock': 2, 'Steel': 0.5, 'Fairy': 2},
-    'Fairy': {'Fire': 0.5, 'Fighting': 2, 'Poison': 0.5, 'Dragon': 2, 'Dark': 2, 'Steel': 0.5},
-}
+# Tipos na ordem das linhas/colunas de TYPE_CHART
+TYPES = [
+    'Normal', 'Fire', 'Water', 'Electric', 'Grass', 'Ice',
+    'Fighting', 'Poison', 'Ground', 'Flying', 'Psychic', 'Bug',
+    'Rock', 'Ghost', 'Dragon', 'Dark', 'Steel', 'Fairy'
+]
+TYPE_INDEX = {t: i for i, t in enumerate(TYPES)}
+
+# Matriz de efetividade (linha = tipo atacante, coluna = tipo defensor, ambos na ordem de TYPES).
+# É a fonte única: as tabelas abaixo e a cobertura de times são derivadas dela.
+TYPE_CHART = np.array([
+    [  1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,  .5,   0,   1,   1,  .5,   1],  # Normal
+    [  1,  .5,  .5,   1,   2,   2,   1,   1,   1,   1,   1,   2,  .5,   1,  .5,   1,   2,   1],  # Fire
+    [  1,   2,  .5,   1,  .5,   1,   1,   1,   2,   1,   1,   1,   2,   1,  .5,   1,   1,   1],  # Water
+    [  1,   1,   2,  .5,  .5,   1,   1,   1,   0,   2,   1,   1,   1,   1,  .5,   1,   1,   1],  # Electric
+    [  1,  .5,   2,   1,  .5,   1,   1,  .5,   2,  .5,   1,  .5,   2,   1,  .5,   1,  .5,   1],  # Grass
+    [  1,  .5,  .5,   1,   2,  .5,   1,   1,   2,   2,   1,   1,   1,   1,   2,   1,  .5,   1],  # Ice
+    [  2,   1,   1,   1,   1,   2,   1,  .5,   1,  .5,  .5,  .5,   2,   0,   1,   2,   2,  .5],  # Fighting
+    [  1,   1,   1,   1,   2,   1,   1,  .5,  .5,   1,   1,   1,  .5,  .5,   1,   1,   0,   2],  # Poison
+    [  1,   2,   1,   2,  .5,   1,   1,   2,   1,   0,   1,  .5,   2,   1,   1,   1,   2,   1],  # Ground
+    [  1,   1,   1,  .5,   2,   1,   2,   1,   1,   1,   1,   2,  .5,   1,   1,   1,  .5,   1],  # Flying
+    [  1,   1,   1,   1,   1,   1,   2,   2,   1,   1,  .5,   1,   1,   1,   1,   0,  .5,   1],  # Psychic
+    [  1,  .5,   1,   1,   2,   1,  .5,  .5,   1,  .5,   2,   1,   1,  .5,   1,   2,  .5,  .5],  # Bug
+    [  1,   2,   1,   1,   1,   2,  .5,   1,  .5,   2,   1,   2,   1,   1,   1,   1,  .5,   1],  # Rock
+    [  0,   1,   1,   1,   1,   1,   1,   1,   1,   1,   2,   1,   1,   2,   1,  .5,   1,   1],  # Ghost
+    [  1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   1,   2,   1,  .5,   0],  # Dragon
+    [  1,   1,   1,   1,   1,   1,  .5,   1,   1,   1,   2,   1,   1,   2,   1,  .5,   1,  .5],  # Dark
+    [  1,  .5,  .5,  .5,   1,   2,   1,   1,   1,   1,   1,   1,   2,   1,   1,   1,  .5,   2],  # Steel
+    [  1,  .5,   1,   1,   1,   1,   2,  .5,   1,   1,   1,   1,   1,   1,   2,   2,  .5,   1],  # Fairy
+])
+TYPE_CHART.setflags(write=False)
+
+
+def _types_by_multiplier(multiplier):
+    """Tipo defensor -> tipos atacantes que causam `multiplier` de dano"""
+    return {
+        defender: [TYPES[a] for a in np.flatnonzero(TYPE_CHART[:, d] == multiplier)]
+        for d, defender in enumerate(TYPES)
+    }
 
-# Fraquezas por tipo (tipo defensor -> tipos que causam dano x2)
-TYPE_WEAKNESSES = {
-    'Normal': ['Fighting'],
-    'Fire': ['Water', 'Ground', 'Rock'],
-    'Water': ['Electric', 'Grass'],
-    'Electric': ['Ground'],
-    'Grass': ['Fire', 'Ice', 'Poison', 'Flying', 'Bug'],
-    'Ice': ['Fire', 'Fighting', 'Rock', 'Steel'],
-    'Fighting': ['Flying', 'Psychic', 'Fairy'],
-    'Poison': ['Ground', 'Psychic'],
-    'Ground': ['Water', 'Grass', 'Ice'],
-    'Flying': ['Electric', 'Ice', 'Rock'],
-    'Psychic': ['Bug', 'Ghost', 'Dark'],
-    'Bug': ['Fire', 'Flying', 'Rock'],
-    'Rock': ['Water', 'Grass', 'Fighting', 'Ground', 'Steel'],
-    'Ghost': ['Ghost', 'Dark'],
-    'Dragon': ['Ice', 'Dragon', 'Fairy'],
-    'Dark': ['Fighting', 'Bug', 'Fairy'],
-    'Steel': ['Fire', 'Fighting', 'Ground'],
-    'Fairy': ['Poison', 'Steel'],
-}
 
-# Resistências por tipo
-TYPE_RESISTANCES = {
-    'Normal': [],
-    'Fire': ['Fire', 'Grass', 'Ice', 'Bug', 'Steel', 'Fairy'],
-    'Water': ['Fire', 'Water', 'Ice', 'Steel'],
-    'Electric': ['Electric', 'Flying', 'Steel'],
-    'Grass': ['Water', 'Electric', 'Grass', 'Ground'],
-    'Ice': ['Ice'],
-    'Fighting': ['Bug', 'Rock', 'Dark'],
-    'Poison': ['Grass', 'Fighting', 'Poison', 'Bug', 'Fairy'],
-    'Ground': ['Poison', 'Rock'],
-    'Flying': ['Grass', 'Fighting', 'Bug'],
-    'Psychic': ['Fighting', 'Psychic'],
-    'Bug': ['Grass', 'Fighting', 'Ground'],
-    'Rock': ['Normal', 'Fire', 'Poison', 'Flying'],
-    'Ghost': ['Poison', 'Bug'],
-    'Dragon': ['Fire', 'Water', 'Electric', 'Grass'],
-    'Dark': ['Ghost', 'Dark'],
-    'Steel': ['Normal', 'Grass', 'Ice', 'Flying', 'Psychic', 'Bug', 'Rock', 'Dragon', 'Steel', 'Fairy'],
-    'Fairy': ['Fighting', 'Bug', 'Dark'],
+# Tabela de efetividade de tipos (atacante -> defensor), só com os valores diferentes de 1
+TYPE_EFFECTIVENESS = {
+    attacker: {TYPES[d]: float(m) for d, m in enumerate(TYPE_CHART[a]) if m != 1}
+    for a, attacker in enumerate(TYPES)
 }
 
-# Imunidades por tipo
-TYPE_IMMUNITIES = {
-    'Normal': ['Ghost'],
-    'Fire': [],
-    'Water': [],
-    'Electric': [],
-    'Grass': [],
-    'Ice': [],
-    'Fighting': [],
-    'Poison': [],
-    'Ground': ['Electric'],
-    'Flying': ['Ground'],
-    'Psychic': [],
-    'Bug': [],
-    'Rock': [],
-    'Ghost': ['Normal', 'Fighting'],
-    'Dragon': [],
-    'Dark': ['Psychic'],
-    'Steel': ['Poison'],
-    'Fairy': ['Dragon'],
-}
+# Fraquezas (x2), resistências (x0.5) e imunidades por tipo defensor
+TYPE_WEAKNESSES = _types_by_multiplier(2)
+TYPE_RESISTANCES = _types_by_multiplier(0.5)
+TYPE_IMMUNITIES = _types_by_multiplier(0)
 
 # Mapeamento de nomes para sprites (casos especiais)
 SPRITE_FIXES = {
@@ -567,10 +569,73 @@ def get_ratings_for_format(format_code):
     return DEFAULT_RATINGS['default']
 
 
-def get_available_months():
-    """Lista os meses disponíveis no Smogon Stats"""
+# ==================== CLIENTE HTTP ====================
+
+UPSTREAM_CONNECT_TIMEOUT = 5
+UPSTREAM_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class UpstreamClient:
+    """Cliente HTTP compartilhado: pool de conexões por host, keep-alive e retries com backoff"""
+
+    def __init__(self, pool_size=16, retries=2, backoff=0.5, max_backoff=8):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'PokeStatsBR'
+        # Cada host (smogon, replays, gemini) ganha seu próprio pool com até pool_size conexões
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(int(retry_after), self.max_backoff)
+        # Backoff exponencial com jitter completo
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def request(self, method, url, timeout, retries=None, **kwargs):
+        """Faz a requisição com retries limitados em erros de conexão e respostas 429/5xx
+
+        Timeouts de leitura só são repetidos em GET, já que um POST pode ter sido processado.
+        """
+        retries = self.retries if retries is None else retries
+        idempotent = method.upper() == 'GET'
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, timeout=(UPSTREAM_CONNECT_TIMEOUT, timeout), **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                retryable = idempotent or not isinstance(e, requests.ReadTimeout)
+                if not retryable or attempt >= retries:
+                    raise
+                time.sleep(self._delay(attempt))
+                attempt += 1
+                continue
+            if response.status_code in UPSTREAM_RETRY_STATUS and attempt < retries:
+                delay = self._delay(attempt, response)
+                response.close()
+                time.sleep(delay)
+                attempt += 1
+                continue
+            return response
+
+    def get(self, url, timeout, **kwargs):
+        return self.request('GET', url, timeout, **kwargs)
+
+    def post(self, url, timeout, **kwargs):
+        return self.request('POST', url, timeout, **kwargs)
+
+
+upstream = UpstreamClient()
+
+
+def scrape_available_months():
+    """Lista os meses disponíveis no Smogon Stats (consulta direta ao smogon.com)"""
     try:
-        response = requests.get(f"{BASE_STATS_URL}/", timeout=10)
+        response = upstream.get(f"{BASE_STATS_URL}/", timeout=10)
         response.raise_for_status()
         pattern = r'href="(\d{4}-\d{2})/"'
         months = re.findall(pattern, response.text)
@@ -581,129 +646,1109 @@ def get_available_months():
         return []
 
 
-def get_available_formats_for_month(month):
-    """Lista os formatos disponíveis em um mês específico"""
+def _fetch_formats_listing(month):
+    """Formatos e ratings de um mês no smogon.com ({} se o mês não existir)
+
+    Erros de conexão e timeouts propagam como requests.ConnectionError/Timeout.
+    """
+    response = upstream.get(f"{BASE_STATS_URL}/{month}/chaos/", timeout=10)
+    if response.status_code == 404:
+        return {}
+    response.raise_for_status()
+    pattern = r'href="([a-z0-9]+)-(\d+)\.json"'
+    formats = {}
+    for format_code, rating in re.findall(pattern, response.text):
+        formats.setdefault(format_code, set()).add(int(rating))
+    return {format_code: sorted(ratings) for format_code, ratings in formats.items()}
+
+
+def scrape_available_formats_for_month(month):
+    """Lista formatos e ratings de um mês (consulta direta ao smogon.com); None se falhar"""
     try:
-        response = requests.get(f"{BASE_STATS_URL}/{month}/chaos/", timeout=10)
-        response.raise_for_status()
-        pattern = r'href="([a-z0-9]+)-\d+\.json"'
-        formats = re.findall(pattern, response.text)
-        return list(set(formats))
+        return _fetch_formats_listing(month)
     except Exception as e:
         print(f"Erro ao buscar formatos: {e}")
-        return []
+        return None
+
+
+def scan_local_chaos():
+    """Meses e formatos já presentes no cache em disco: {mês: {formato: [ratings]}}"""
+    root = os.path.join(CACHE_DIR, 'chaos')
+    local = {}
+    try:
+        months = os.listdir(root)
+    except OSError:
+        return local
+    for month in months:
+        if not re.fullmatch(r'\d{4}-\d{2}', month):
+            continue
+        try:
+            names = os.listdir(os.path.join(root, month))
+        except OSError:
+            continue
+        formats = {}
+        for name in names:
+            match = re.fullmatch(r'([a-z0-9]+)-(\d+)\.json', name)
+            # Só arquivos completos (o .meta é gravado depois do arquivo)
+            if match and name + '.meta' in names:
+                formats.setdefault(match.group(1), []).append(int(match.group(2)))
+        if formats:
+            local[month] = {format_code: sorted(ratings) for format_code, ratings in formats.items()}
+    return local
+
+
+class AvailabilityIndex:
+    """Índice em memória de meses/formatos do Smogon, atualizado em background
+
+    Sem acesso ao smogon.com, usa os meses/formatos do cache em disco (ver mirror-stats).
+    """
+
+    def __init__(self, refresh_seconds, months_window, initial_wait):
+        self.refresh_seconds = refresh_seconds
+        self.months_window = months_window
+        self.initial_wait = initial_wait
+        self.months = []
+        self.formats = {}  # mês -> {formato: [ratings]}
+        self.updated = 0
+        self._offline_until = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def ensure_started(self):
+        """Inicia o scheduler (uma thread por processo, já que threads não sobrevivem ao fork do gunicorn)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='availability-index', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Erro ao atualizar índice de meses: {e}")
+            time.sleep(self.refresh_seconds)
+
+    def refresh(self):
+        """Atualiza a lista de meses e os formatos dos meses mais recentes"""
+        months = scrape_available_months()
+        if not months:
+            # Mantém o índice anterior se o smogon.com estiver fora do ar; sem índice, usa o disco
+            if not self.months:
+                local_months = sorted(scan_local_chaos(), reverse=True)
+                if local_months:
+                    with self._lock:
+                        self.months = local_months
+                    self._ready.set()
+            return
+        with self._lock:
+            self.months = months
+            self.updated = time.time()
+        self._ready.set()
+
+        for month in months[:self.months_window]:
+            # Listagens de meses fechados nunca mudam
+            if month in self.formats and is_month_final(month):
+                continue
+            formats = scrape_available_formats_for_month(month)
+            if formats is not None:
+                with self._lock:
+                    self.formats[month] = formats
+
+    def get_months(self):
+        self.ensure_started()
+        if not self._ready.is_set():
+            # Só a primeira requisição após o boot espera pelo índice, e por tempo limitado
+            self._ready.wait(self.initial_wait)
+        return list(self.months)
+
+    def get_formats(self, month):
+        self.ensure_started()
+        formats = self.formats.get(month)
+        if formats is None:
+            if time.time() < self._offline_until:
+                return scan_local_chaos().get(month, {})
+            # Meses fora da janela atualizada são buscados uma única vez
+            try:
+                formats = _fetch_formats_listing(month)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                # Sem smogon.com: responde pelo disco e só tenta de novo depois de um tempo
+                print(f"Erro ao buscar formatos: {e}")
+                self._offline_until = time.time() + AVAILABILITY_OFFLINE_RETRY_SECONDS
+                return scan_local_chaos().get(month, {})
+            except Exception as e:
+                print(f"Erro ao buscar formatos: {e}")
+                return scan_local_chaos().get(month, {})
+            if not formats:
+                # Mês inexistente ou ainda não publicado (404): não guarda nem entra em modo offline
+                return scan_local_chaos().get(month, {})
+            with self._lock:
+                self.formats[month] = formats
+        return formats
+
+    def matrix(self):
+        """Retorna {formato: {mês: [ratings]}} para os meses indexados"""
+        self.ensure_started()
+        with self._lock:
+            snapshot = dict(self.formats)
+        matrix = {}
+        for month, formats in snapshot.items():
+            for format_code, ratings in formats.items():
+                matrix.setdefault(format_code, {})[month] = ratings
+        return matrix
+
+
+AVAILABILITY_REFRESH_SECONDS = 30 * 60
+AVAILABILITY_OFFLINE_RETRY_SECONDS = 60
+availability_index = AvailabilityIndex(
+    refresh_seconds=AVAILABILITY_REFRESH_SECONDS,
+    months_window=12,
+    initial_wait=10,
+)
+
+
+def get_available_months():
+    """Lista os meses disponíveis no Smogon Stats (índice em memória)"""
+    return availability_index.get_months()
+
+
+def get_available_formats_for_month(month):
+    """Lista os formatos disponíveis em um mês específico (índice em memória)"""
+    return sorted(availability_index.get_formats(month))
+
+
+# ==================== CACHE ====================
+
+class LRUCache:
+    """Cache LRU em memória limitado pelo tamanho total das entradas (em bytes)"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SingleFlight:
+    """Agrupa chamadas concorrentes com a mesma chave em uma única execução"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'done': threading.Event(), 'result': None, 'error': None}
+                self._calls[key] = call
+
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+
+        try:
+            call['result'] = fn(*args)
+        except BaseException as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['done'].set()
+        return call['result']
+
+
+class SQLiteStore:
+    """Base para stores em SQLite compartilhados entre threads e workers do mesmo nó"""
+
+    SCHEMA = ()
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        # Conexões SQLite não podem atravessar threads nem o fork do gunicorn
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+# Entradas mais antigas que isto são apagadas do cache compartilhado (replays são buscados de novo)
+SHARED_CACHE_MAX_AGE = float(os.environ.get('POKESTATS_SHARED_CACHE_DAYS', '30')) * 24 * 60 * 60
+SHARED_CACHE_PRUNE_INTERVAL = 60 * 60
+
+
+class SharedCache(SQLiteStore):
+    """Cache chave -> bytes em SQLite, compartilhado entre os workers do gunicorn do mesmo nó
+
+    Cada escrita é uma transação (INSERT OR REPLACE), então leitores nunca veem valores parciais.
+    As escritas disparam, no máximo uma vez por SHARED_CACHE_PRUNE_INTERVAL, a limpeza das
+    entradas mais antigas que `max_age`.
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS entries ('
+        'key TEXT PRIMARY KEY, value BLOB NOT NULL, created REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS entries_created ON entries (created)',
+    )
+
+    def __init__(self, path, max_age=SHARED_CACHE_MAX_AGE):
+        super().__init__(path)
+        self.max_age = max_age
+        self._next_prune = 0
+
+    def get(self, key, max_age=None):
+        """Retorna (valor, criado_em) ou None se ausente/expirado"""
+        try:
+            row = self._connect().execute('SELECT value, created FROM entries WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Erro ao ler cache compartilhado: {e}")
+            return None
+        if row is None or (max_age is not None and time.time() - row[1] >= max_age):
+            return None
+        return bytes(row[0]), row[1]
+
+    def set(self, key, value, created=None):
+        try:
+            self._connect().execute(
+                'INSERT OR REPLACE INTO entries (key, value, created) VALUES (?, ?, ?)',
+                (key, value, created if created is not None else time.time()),
+            )
+        except sqlite3.Error as e:
+            print(f"Erro ao gravar cache compartilhado: {e}")
+        if time.time() >= self._next_prune:
+            self.prune()
+
+    def prune(self):
+        """Apaga as entradas mais antigas que `max_age`; retorna quantas foram removidas"""
+        self._next_prune = time.time() + SHARED_CACHE_PRUNE_INTERVAL
+        try:
+            cursor = self._connect().execute('DELETE FROM entries WHERE created < ?', (time.time() - self.max_age,))
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"Erro ao limpar cache compartilhado: {e}")
+            return 0
+
+
+shared_cache = SharedCache(os.path.join(CACHE_DIR, 'shared.sqlite3'))
+
+
+# Downloads + processamento em andamento, compartilhados entre as threads do worker
+upstream_flight = SingleFlight()
+
+
+def write_file_atomic(path, content):
+    """Grava um arquivo de forma atômica (arquivo temporário + rename)"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def read_json_file(path):
+    """Lê um arquivo JSON do disco, retornando None se não existir ou estiver corrompido"""
+    try:
+        with open(path, 'rb') as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def is_month_final(month):
+    """Indica se um mês de stats já está fechado (nunca mais muda no Smogon)"""
+    try:
+        year, mon = (int(part) for part in month.split('-'))
+    except (AttributeError, ValueError):
+        return False
+    now = datetime.now(timezone.utc)
+    # O Smogon publica o mês M no início de M+1; só o mês anterior ao atual ainda pode ser republicado
+    last_open = (now.year, now.month - 1) if now.month > 1 else (now.year - 1, 12)
+    return (year, mon) < last_open
+
 
+def _chaos_cache_path(format_code, rating, month):
+    return os.path.join(CACHE_DIR, 'chaos', month, f"{format_code}-{rating}.json")
 
-def fetch_smogon_data(format_code, rating, month):
-    """Busca dados do Smogon Stats"""
+
+CHAOS_CHUNK_SIZE = 64 * 1024
+
+
+def _read_file_chunks(path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHAOS_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def iter_chaos_chunks(format_code, rating, month):
+    """Gera os bytes de um arquivo chaos em blocos (disco, ou smogon.com gravando no disco)
+
+    Não gera nada se o arquivo não estiver disponível.
+    """
     url = f"{BASE_STATS_URL}/{month}/chaos/{format_code}-{rating}.json"
+    final = is_month_final(month)
+
+    path = _chaos_cache_path(format_code, rating, month)
+    meta = read_json_file(path + '.meta')
+    on_disk = meta is not None and os.path.exists(path)
+    if on_disk and (final or time.time() - meta.get('validated', 0) < CHAOS_REVALIDATE_SECONDS):
+        yield from _read_file_chunks(path)
+        return
+
+    headers = {}
+    if on_disk:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
     try:
-        response = requests.get(url, timeout=30)
+        response = upstream.get(url, timeout=30, headers=headers, stream=True)
+        if response.status_code == 304 and on_disk:
+            response.close()
+            meta['validated'] = time.time()
+            write_file_atomic(path + '.meta', json.dumps(meta).encode('utf-8'))
+            yield from _read_file_chunks(path)
+            return
         response.raise_for_status()
-        return response.json()
     except Exception as e:
+        if on_disk:
+            print(f"Erro ao revalidar {url}: {e} (usando cópia em disco)")
+            yield from _read_file_chunks(path)
+            return
         print(f"Erro ao buscar {url}: {e}")
-        return None
+        return
 
+    # Content-Length só confere com os bytes recebidos quando o corpo não vem comprimido
+    expected = response.headers.get('Content-Length')
+    if response.headers.get('Content-Encoding', 'identity') != 'identity':
+        expected = None
 
-def process_pokemon_data(raw_json):
-    """Processa JSON bruto do Smogon"""
-    if not raw_json or 'data' not in raw_json:
+    # Repassa o corpo em blocos enquanto grava uma cópia temporária ao lado do cache
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f, response:
+            for chunk in response.iter_content(CHAOS_CHUNK_SIZE):
+                f.write(chunk)
+                size += len(chunk)
+                yield chunk
+        if expected is not None and size != int(expected):
+            raise IOError(f"{url}: recebidos {size} de {expected} bytes")
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    meta = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'validated': time.time(),
+        'size': size,
+    }
+    try:
+        write_file_atomic(path + '.meta', json.dumps(meta).encode('utf-8'))
+    except OSError as e:
+        print(f"Erro ao gravar cache {path}: {e}")
+
+
+_json_decoder = json.JSONDecoder()
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def iter_chaos_entries(chunks):
+    """Parser incremental do JSON chaos
+
+    Gera ('meta', chave, valor) para as chaves de topo (ex.: 'info') e
+    ('pokemon', nome, entrada) para cada Pokémon de 'data', um por vez.
+    A memória fica limitada a uma entrada mais um bloco de leitura.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    state = {'buf': '', 'pos': 0, 'eof': False}
+
+    def more(target=CHAOS_CHUNK_SIZE):
+        """Lê pelo menos `target` bytes (ou até o fim) e anexa ao buffer de uma vez"""
+        if state['eof']:
+            raise ValueError('JSON chaos truncado')
+        parts = []
+        size = 0
+        while size < target:
+            chunk = next(chunks, None)
+            if chunk is None:
+                state['eof'] = True
+                parts.append(decoder.decode(b'', final=True))
+                break
+            parts.append(decoder.decode(chunk))
+            size += len(chunk)
+        state['buf'] += ''.join(parts)
+
+    def skip_ws():
+        while True:
+            state['pos'] = _JSON_WHITESPACE.match(state['buf'], state['pos']).end()
+            if state['pos'] < len(state['buf']):
+                return state['buf'][state['pos']]
+            more()
+
+    def expect(chars):
+        char = skip_ws()
+        if char not in chars:
+            raise ValueError(f"JSON chaos inválido: esperado {chars!r}, encontrado {char!r}")
+        state['pos'] += 1
+        return char
+
+    def value():
+        skip_ws()
+        while True:
+            try:
+                result, end = _json_decoder.raw_decode(state['buf'], state['pos'])
+                # Um valor que termina no fim do buffer pode estar incompleto (ex.: números)
+                if end < len(state['buf']) or state['eof']:
+                    break
+            except json.JSONDecodeError:
+                if state['eof']:
+                    raise
+            # Dobra o buffer antes de tentar de novo, para não re-decodificar a cada bloco pequeno
+            more(max(len(state['buf']) - state['pos'], CHAOS_CHUNK_SIZE))
+        # Descarta o que já foi consumido para manter o buffer pequeno
+        state['buf'] = state['buf'][end:]
+        state['pos'] = 0
+        return result
+
+    def finish():
+        """Lê até o fim do stream (o cache em disco só é gravado no fim) e rejeita lixo após o JSON"""
+        while True:
+            state['pos'] = _JSON_WHITESPACE.match(state['buf'], state['pos']).end()
+            if state['pos'] < len(state['buf']):
+                raise ValueError('JSON chaos inválido: conteúdo após o fim do objeto')
+            if state['eof']:
+                return
+            state['buf'] = ''
+            state['pos'] = 0
+            more()
+
+    expect('{')
+    if skip_ws() == '}':
+        state['pos'] += 1
+        finish()
+        return
+    while True:
+        key = value()
+        expect(':')
+        if key == 'data' and skip_ws() == '{':
+            state['pos'] += 1
+            if skip_ws() == '}':
+                state['pos'] += 1
+                yield 'meta', key, {}
+            else:
+                while True:
+                    name = value()
+                    expect(':')
+                    yield 'pokemon', name, value()
+                    if expect(',}') == '}':
+                        break
+        else:
+            yield 'meta', key, value()
+        if expect(',}') == '}':
+            finish()
+            return
+
+
+def load_chaos_snapshot(format_code, rating, month):
+    """Monta o ChaosSnapshot de um arquivo chaos direto do stream (disco ou HTTP)"""
+    try:
+        return ChaosSnapshot.from_entries(iter_chaos_entries(iter_chaos_chunks(format_code, rating, month)))
+    except Exception as e:
+        print(f"Erro ao ler {format_code}-{rating} ({month}): {e}")
         return None
 
-    processed = {
-        'info': raw_json.get('info', {}),
-        'pokemon': {}
-    }
 
-    def calc_percentages(category_dict, top_n=None):
-        if not category_dict:
-            return []
-        total = sum(category_dict.values())
-        if total == 0:
-            return []
-        items = [(k, (v / total) * 100) for k, v in category_dict.items()]
-        items.sort(key=lambda x: x[1], reverse=True)
-        if top_n:
-            items = items[:top_n]
-        return [{'name': k, 'percentage': round(v, 2)} for k, v in items]
+class StringTable:
+    """Tabela de strings internadas (string <-> id inteiro)"""
+
+    def __init__(self):
+        self.strings = []
+        self.ids = {}
+
+    def intern(self, value):
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.ids[value] = string_id
+            self.strings.append(value)
+        return string_id
+
+    def freeze(self):
+        """Descarta o dicionário reverso quando não há mais strings a internar"""
+        self.ids = None
+
+    def __getitem__(self, string_id):
+        return self.strings[string_id]
+
+    def __len__(self):
+        return len(self.strings)
+
+    @property
+    def nbytes(self):
+        total = sum(sys.getsizeof(value) for value in self.strings) + sys.getsizeof(self.strings)
+        if self.ids is not None:
+            total += sys.getsizeof(self.ids)
+        return total
+
+
+class SparseColumn:
+    """Coluna esparsa em formato CSR: para cada linha, pares (id da string, valor)"""
+
+    __slots__ = ('offsets', 'ids', 'values')
 
-    def parse_spread(spread_str):
+    def __init__(self, id_typecode='I'):
+        self.offsets = array('I', [0])
+        self.ids = array(id_typecode)
+        self.values = array('d')
+
+    def append_row(self, pairs):
+        for string_id, value in pairs:
+            self.ids.append(string_id)
+            self.values.append(value)
+        self.offsets.append(len(self.ids))
+
+    def row(self, row):
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.ids[start:end], self.values[start:end]
+
+    @property
+    def nbytes(self):
+        return sum(len(column) * column.itemsize for column in (self.offsets, self.ids, self.values))
+
+
+# Categoria do chaos -> tabela de strings usada pelos ids da coluna
+CHAOS_COLUMNS = {
+    'Abilities': 'abilities',
+    'Items': 'items',
+    'Moves': 'moves',
+    'Spreads': 'spreads',
+    'Teammates': 'species',
+    'Tera Types': 'tera',
+    'Checks and Counters': 'species',
+    'Happiness': 'happiness',
+}
+
+
+# Spreads são codificados em 64 bits: id da nature << 48 | 6 EVs de 8 bits.
+# Strings fora do padrão vão para a tabela 'spreads' com este bit ligado.
+SPREAD_FALLBACK_FLAG = 1 << 63
+
+
+class ChaosSnapshot:
+    """Arquivo chaos em formato colunar compacto (strings internadas + arrays)"""
+
+    def __init__(self, info):
+        self.info = info
+        self.tables = {name: StringTable() for name in set(CHAOS_COLUMNS.values()) | {'natures'}}
+        self.columns = {
+            category: SparseColumn('Q' if category == 'Spreads' else 'I')
+            for category in CHAOS_COLUMNS
+        }
+        self.row_species = array('I')
+        self.species_row = {}
+        self.usage = array('d')
+        self.raw_count = array('q')
+        self.viability = []
+
+    @classmethod
+    def from_json(cls, raw_json):
+        snapshot = cls(raw_json.get('info', {}))
+        for pokemon_name, data in raw_json['data'].items():
+            snapshot.add_pokemon(pokemon_name, data)
+        snapshot.freeze()
+        return snapshot
+
+    @classmethod
+    def from_entries(cls, entries):
+        """Monta o snapshot a partir de iter_chaos_entries; None se não houver 'data'"""
+        snapshot = cls({})
+        has_data = False
+        for kind, key, value in entries:
+            if kind == 'pokemon':
+                snapshot.add_pokemon(key, value)
+                has_data = True
+            elif key == 'info':
+                snapshot.info = value
+            elif key == 'data':
+                has_data = True
+        if not has_data:
+            return None
+        snapshot.freeze()
+        return snapshot
+
+    def add_pokemon(self, pokemon_name, data):
+        """Adiciona a entrada de um Pokémon do JSON do Smogon como nova linha"""
+        species = self.tables['species']
+        species_id = species.intern(pokemon_name)
+        self.species_row[species_id] = len(self.row_species)
+        self.row_species.append(species_id)
+        self.usage.append(data.get('usage', 0))
+        self.raw_count.append(int(data.get('Raw count', 0)))
+        self.viability.append(tuple(data.get('Viability Ceiling', ())))
+
+        for category, table_name in CHAOS_COLUMNS.items():
+            table = self.tables[table_name]
+            values = data.get(category) or {}
+            if category == 'Checks and Counters':
+                # Só o score (segunda posição) é usado no processamento
+                pairs = [(table.intern(name), value[1] or 0) for name, value in values.items()
+                         if isinstance(value, list) and len(value) >= 2]
+            elif category == 'Spreads':
+                pairs = [(self.encode_spread(name), value) for name, value in values.items()]
+            else:
+                pairs = [(table.intern(name), value) for name, value in values.items()]
+            self.columns[category].append_row(pairs)
+
+    def encode_spread(self, spread_str):
         try:
             nature, evs = spread_str.split(':')
-            ev_values = evs.split('/')
-            return {
-                'nature': nature,
-                'hp': int(ev_values[0]),
-                'atk': int(ev_values[1]),
-                'def': int(ev_values[2]),
-                'spa': int(ev_values[3]),
-                'spd': int(ev_values[4]),
-                'spe': int(ev_values[5])
-            }
-        except:
+            ev_values = [int(ev) for ev in evs.split('/')]
+        except ValueError:
+            ev_values = None
+        if (ev_values and len(ev_values) == 6 and all(0 <= ev <= 255 for ev in ev_values)
+                and f"{nature}:{'/'.join(map(str, ev_values))}" == spread_str):
+            code = self.tables['natures'].intern(nature)
+            for ev in ev_values:
+                code = (code << 8) | ev
+            return code
+        return SPREAD_FALLBACK_FLAG | self.tables['spreads'].intern(spread_str)
+
+    def decode_spread(self, code):
+        if code & SPREAD_FALLBACK_FLAG:
+            return self.tables['spreads'][code & ~SPREAD_FALLBACK_FLAG]
+        evs = '/'.join(str((code >> shift) & 0xFF) for shift in range(40, -8, -8))
+        return f"{self.tables['natures'][code >> 48]}:{evs}"
+
+    def freeze(self):
+        """Finaliza a construção; só a tabela de espécies mantém a busca por nome"""
+        for name, table in self.tables.items():
+            if name != 'species':
+                table.freeze()
+
+    def to_sections(self):
+        """Seções (nome, typecode, bytes) do formato binário; ver save_snapshot_file"""
+        sections = [('info', 'B', json.dumps(self.info).encode('utf-8')),
+                    ('viability', 'B', json.dumps(self.viability).encode('utf-8')),
+                    ('row_species', 'I', self.row_species),
+                    ('usage', 'd', self.usage),
+                    ('raw_count', 'q', self.raw_count)]
+        for name, table in sorted(self.tables.items()):
+            # Strings separadas por NUL: a tabela inteira volta com um único decode + split.
+            # A contagem separa uma tabela vazia de uma tabela só com '' (ex.: golpe "" do chaos)
+            sections.append((f'str:{name}', 'B', '\0'.join(table.strings).encode('utf-8')))
+            sections.append((f'str:{name}:count', 'I', array('I', [len(table)])))
+        for category, column in sorted(self.columns.items()):
+            id_typecode = 'Q' if category == 'Spreads' else 'I'
+            sections.append((f'col:{category}:offsets', 'I', column.offsets))
+            sections.append((f'col:{category}:ids', id_typecode, column.ids))
+            sections.append((f'col:{category}:values', 'd', column.values))
+        return sections
+
+    @classmethod
+    def from_sections(cls, sections):
+        """Snapshot sobre memoryviews (somente leitura) das seções de um arquivo mapeado"""
+        snapshot = cls(json.loads(bytes(sections['info'])))
+        snapshot.viability = [tuple(values) for values in json.loads(bytes(sections['viability']))]
+        snapshot.row_species = sections['row_species']
+        snapshot.usage = sections['usage']
+        snapshot.raw_count = sections['raw_count']
+        for name, table in snapshot.tables.items():
+            count = sections[f'str:{name}:count'][0]
+            table.strings = bytes(sections[f'str:{name}']).decode('utf-8').split('\0') if count else []
+            if len(table.strings) != count:
+                raise ValueError(f'tabela {name}: {len(table.strings)} strings, esperadas {count}')
+            table.ids = None
+        species = snapshot.tables['species']
+        species.ids = {value: string_id for string_id, value in enumerate(species.strings)}
+        for category, column in snapshot.columns.items():
+            column.offsets = sections[f'col:{category}:offsets']
+            column.ids = sections[f'col:{category}:ids']
+            column.values = sections[f'col:{category}:values']
+        snapshot.species_row = {species_id: row for row, species_id in enumerate(snapshot.row_species)}
+        return snapshot
+
+    def __len__(self):
+        return len(self.row_species)
+
+    def species_names(self):
+        species = self.tables['species']
+        return [species[species_id] for species_id in self.row_species]
+
+    def row_of(self, pokemon_name):
+        species_id = self.tables['species'].ids.get(pokemon_name)
+        if species_id is None:
             return None
+        return self.species_row.get(species_id)
+
+    def pairs(self, category, row):
+        """Lista de (nome, valor) de uma categoria para uma linha, na ordem original"""
+        ids, values = self.columns[category].row(row)
+        if category == 'Spreads':
+            return [(self.decode_spread(code), value) for code, value in zip(ids, values)]
+        table = self.tables[CHAOS_COLUMNS[category]]
+        return [(table[string_id], value) for string_id, value in zip(ids, values)]
+
+    @property
+    def nbytes(self):
+        """Estimativa do custo em memória do snapshot"""
+        total = sum(table.nbytes for table in self.tables.values())
+        total += sum(column.nbytes for column in self.columns.values())
+        total += (len(self.row_species) * 4 + len(self.usage) * 8 + len(self.raw_count) * 8)
+        total += sys.getsizeof(self.species_row) + sum(sys.getsizeof(v) for v in self.viability)
+        return total
+
+
+# Formato binário dos snapshots (CACHE_DIR/snapshots): cabeçalho, diretório de seções e
+# seções alinhadas em 8 bytes com arrays nativos, lidos via mmap sem cópia. Incrementar a
+# versão sempre que ChaosSnapshot ou o processamento mudarem: arquivos antigos são refeitos.
+SNAPSHOT_MAGIC = b'PKSN'
+SNAPSHOT_FORMAT_VERSION = 2
+_SNAPSHOT_HEADER = struct.Struct('<4sHBxdI')  # magic, versão, ordem dos bytes, criado em, nº de seções
+_SNAPSHOT_SECTION = struct.Struct('<32scQQ')  # nome, typecode, offset, tamanho em bytes
+_BYTE_ORDER = 0 if sys.byteorder == 'little' else 1
+
+
+def _snapshot_path(*parts):
+    return os.path.join(CACHE_DIR, 'snapshots', *parts[:-1], f"{parts[-1]}.snap")
+
+
+def save_snapshot_file(path, snapshot, created):
+    """Grava o snapshot no formato binário (escrita atômica); erros só são registrados"""
+    sections = [(name, typecode, data if isinstance(data, bytes) else bytes(memoryview(data).cast('B')))
+                for name, typecode, data in snapshot.to_sections()]
+    offset = _SNAPSHOT_HEADER.size + _SNAPSHOT_SECTION.size * len(sections)
+    directory = []
+    payload = []
+    for name, typecode, data in sections:
+        padding = -offset % 8
+        payload.append(b'\0' * padding + data)
+        offset += padding
+        directory.append(_SNAPSHOT_SECTION.pack(name.encode('ascii'), typecode.encode('ascii'), offset, len(data)))
+        offset += len(data)
+    header = _SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, _BYTE_ORDER, created, len(sections))
+    try:
+        write_file_atomic(path, b''.join([header] + directory + payload))
+    except OSError as e:
+        # No Windows um arquivo mapeado não pode ser substituído; o snapshot em memória segue valendo
+        print(f"Erro ao gravar snapshot {path}: {e}")
+
 
-    for pokemon_name, data in raw_json['data'].items():
-        usage = data.get('usage', 0) * 100
+def load_snapshot_file(path, max_age=None):
+    """Abre um snapshot binário via mmap; retorna (snapshot, criado em) ou None
 
-        spreads_raw = data.get('Spreads', {})
+    None se o arquivo não existir, for de outra versão/arquitetura, estiver corrompido
+    ou for mais velho que `max_age` segundos. As páginas são compartilhadas entre
+    processos pelo cache do sistema operacional.
+    """
+    try:
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        magic, version, byte_order, created, count = _SNAPSHOT_HEADER.unpack_from(mapped, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT_VERSION or byte_order != _BYTE_ORDER:
+            return None
+        if max_age is not None and time.time() - created > max_age:
+            return None
+        view = memoryview(mapped)
+        sections = {}
+        for i in range(count):
+            name, typecode, offset, length = _SNAPSHOT_SECTION.unpack_from(
+                mapped, _SNAPSHOT_HEADER.size + i * _SNAPSHOT_SECTION.size)
+            if offset + length > len(mapped):
+                raise ValueError(f"seção fora do arquivo: {name!r}")
+            sections[name.rstrip(b'\0').decode('ascii')] = view[offset:offset + length].cast(typecode.decode('ascii'))
+        return ChaosSnapshot.from_sections(sections), created
+    except Exception as e:
+        print(f"Snapshot inválido {path}: {e}")
+        return None
+
+
+def calc_percentages(pairs, top_n=None):
+    """Converte pares (nome, contagem) em porcentagens ordenadas (top_n usa seleção parcial)"""
+    if not pairs:
+        return []
+    total = sum(value for _, value in pairs)
+    if total == 0:
+        return []
+    if top_n:
+        items = heapq.nlargest(top_n, pairs, key=lambda x: x[1])
+    else:
+        items = sorted(pairs, key=lambda x: x[1], reverse=True)
+    return [{'name': k, 'percentage': round((v / total) * 100, 2)} for k, v in items]
+
+
+def parse_spread(spread_str):
+    """Converte 'Nature:hp/atk/def/spa/spd/spe' em dicionário"""
+    try:
+        nature, evs = spread_str.split(':')
+        ev_values = evs.split('/')
+        return {
+            'nature': nature,
+            'hp': int(ev_values[0]),
+            'atk': int(ev_values[1]),
+            'def': int(ev_values[2]),
+            'spa': int(ev_values[3]),
+            'spd': int(ev_values[4]),
+            'spe': int(ev_values[5])
+        }
+    except:
+        return None
+
+
+class ProcessedFormat:
+    """Stats processadas de um formato: ranking calculado na criação, detalhes sob demanda"""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.info = snapshot.info
+        self._details = {}
+        self._team_builder = None
+        self._checks_index = None
+        self._search_index = None
+
+        names = snapshot.species_names()
+        usages = [(name, round(usage * 100, 2)) for name, usage in zip(names, snapshot.usage)]
+        usages.sort(key=lambda x: x[1], reverse=True)
+
+        self.ranks = {}
+        self.ranked_list = []
+        for rank, (name, usage) in enumerate(usages, 1):
+            self.ranks[name] = rank
+            self.ranked_list.append({'name': name, 'usage': usage, 'rank': rank, 'sprite_name': get_sprite_name(name)})
+        self.index = {name.lower(): name for name in names}
+
+    def __len__(self):
+        return len(self.ranked_list)
+
+    def __contains__(self, pokemon_name):
+        return pokemon_name.lower() in self.index
+
+    def resolve(self, pokemon_name):
+        """Nome canônico de um Pokémon (busca sem diferenciar maiúsculas)"""
+        return self.index.get(pokemon_name.lower())
+
+    def get(self, pokemon_name):
+        """Detalhes de um Pokémon, montados no primeiro acesso e memorizados"""
+        name = self.resolve(pokemon_name)
+        if name is None:
+            return None
+        details = self._details.get(name)
+        if details is None:
+            details = self._details.setdefault(name, self._build_details(name))
+        return details
+
+    def search_index(self):
+        """Índice de busca, construído no primeiro uso e reaproveitado"""
+        if self._search_index is None:
+            self._search_index = SearchIndex(self.snapshot)
+        return self._search_index
+
+    def checks_index(self):
+        """Índice de checks, construído no primeiro uso e reaproveitado"""
+        if self._checks_index is None:
+            self._checks_index = ChecksIndex(self.snapshot)
+        return self._checks_index
+
+    def team_builder(self):
+        """Modelo do montador de times, construído no primeiro uso e reaproveitado"""
+        if self._team_builder is None:
+            self._team_builder = TeamBuilderModel(self.snapshot)
+        return self._team_builder
+
+    def to_dict(self, fields=None, offset=0, limit=None, summary=False):
+        """Formato serializável; sem argumentos é o formato completo (monta os detalhes de todos)
+
+        offset/limit paginam o ranking (e os detalhes junto), fields restringe os campos
+        de cada Pokémon e summary omite os detalhes.
+        """
+        end = offset + limit if limit is not None else None
+        ranked = self.ranked_list[offset:end]
+        data = {'info': self.info, 'ranked_list': ranked, 'total': len(self.ranked_list)}
+        if not summary:
+            pokemon = {}
+            for entry in ranked:
+                details = self.get(entry['name'])
+                if fields:
+                    details = {field: details[field] for field in fields}
+                pokemon[entry['name']] = details
+            data['pokemon'] = pokemon
+        return data
+
+    def _build_details(self, pokemon_name):
+        snapshot = self.snapshot
+        row = snapshot.row_of(pokemon_name)
+        usage = snapshot.usage[row] * 100
+
+        spreads_raw = snapshot.pairs('Spreads', row)
         spreads_processed = []
-        total_spreads = sum(spreads_raw.values()) if spreads_raw else 0
-        for spread_str, count in sorted(spreads_raw.items(), key=lambda x: x[1], reverse=True)[:10]:
+        total_spreads = sum(count for _, count in spreads_raw)
+        for spread_str, count in heapq.nlargest(10, spreads_raw, key=lambda x: x[1]):
             parsed = parse_spread(spread_str)
             if parsed:
                 parsed['percentage'] = round((count / total_spreads) * 100, 2) if total_spreads > 0 else 0
                 parsed['raw'] = spread_str
                 spreads_processed.append(parsed)
 
-        teammates_raw = data.get('Teammates', {})
         teammates = [
             {'name': k, 'score': round(v * 100, 2)}
-            for k, v in sorted(teammates_raw.items(), key=lambda x: x[1], reverse=True)[:10]
+            for k, v in heapq.nlargest(10, snapshot.pairs('Teammates', row), key=lambda x: x[1])
             if v > 0
         ]
 
-        # Checks and Counters
-        checks_raw = data.get('Checks and Counters', {})
-        checks = []
-        for check_name, check_data in sorted(checks_raw.items(), key=lambda x: x[1][1] if len(x[1]) > 1 else 0, reverse=True)[:10]:
-            if isinstance(check_data, list) and len(check_data) >= 2:
-                checks.append({
-                    'name': check_name,
-                    'score': round(check_data[1], 2) if check_data[1] else 0
-                })
-
-        processed['pokemon'][pokemon_name] = {
+        # Checks and Counters (o snapshot guarda apenas o score de cada check)
+        checks = [
+            {'name': check_name, 'score': round(score, 2) if score else 0}
+            for check_name, score in heapq.nlargest(10, snapshot.pairs('Checks and Counters', row), key=lambda x: x[1])
+        ]
+
+        return {
             'name': pokemon_name,
             'sprite_name': get_sprite_name(pokemon_name),
             'usage': round(usage, 2),
-            'raw_count': data.get('Raw count', 0),
-            'viability': data.get('Viability Ceiling', []),
-            'abilities': calc_percentages(data.get('Abilities', {})),
-            'items': calc_percentages(data.get('Items', {}), 15),
-            'moves': calc_percentages(data.get('Moves', {}), 15),
+            'raw_count': snapshot.raw_count[row],
+            'viability': list(snapshot.viability[row]),
+            'abilities': calc_percentages(snapshot.pairs('Abilities', row)),
+            'items': calc_percentages(snapshot.pairs('Items', row), 15),
+            'moves': calc_percentages(snapshot.pairs('Moves', row), 15),
             'spreads': spreads_processed,
             'teammates': teammates,
-            'tera_types': calc_percentages(data.get('Tera Types', {})),
+            'tera_types': calc_percentages(snapshot.pairs('Tera Types', row)),
             'checks': checks,
-            'happiness': data.get('Happiness', {}),
+            'happiness': dict(snapshot.pairs('Happiness', row)),
+            'rank': self.ranks[pokemon_name],
         }
 
-    sorted_pokemon = sorted(
-        processed['pokemon'].items(),
-        key=lambda x: x[1]['usage'],
-        reverse=True
-    )
-    for rank, (name, _) in enumerate(sorted_pokemon, 1):
-        processed['pokemon'][name]['rank'] = rank
 
-    processed['ranked_list'] = [
-        {'name': name, 'usage': data['usage'], 'rank': data['rank'], 'sprite_name': data['sprite_name']}
-        for name, data in sorted_pokemon
-    ]
+# Campos dos detalhes de cada Pokémon (ver ProcessedFormat._build_details), para ?fields=
+POKEMON_FIELDS = (
+    'name', 'sprite_name', 'usage', 'raw_count', 'viability', 'abilities', 'items', 'moves',
+    'spreads', 'teammates', 'tera_types', 'checks', 'happiness', 'rank',
+)
+
+
+def process_pokemon_data(source):
+    """Processa JSON bruto do Smogon ou um ChaosSnapshot (retorna ProcessedFormat com detalhes preguiçosos)"""
+    if isinstance(source, ChaosSnapshot):
+        return ProcessedFormat(source)
+    if not source or 'data' not in source:
+        return None
+    return ProcessedFormat(ChaosSnapshot.from_json(source))
+
+
+# Nível em memória: snapshots compactos processados por (formato, rating, mês);
+# o nível em disco fica em CACHE_DIR/chaos (ver iter_chaos_chunks)
+_processed_memory = LRUCache(CHAOS_MEMORY_BUDGET)
+PROCESSED_BYTES_PER_POKEMON = 1024
+
+
+def get_processed_stats(format_code, rating, month):
+    """Retorna as stats processadas de um formato (com cache) ou None"""
+    key = (format_code, str(rating), month)
+    entry = _processed_memory.get(key)
+    if entry and (is_month_final(month) or time.time() - entry['created'] < CHAOS_REVALIDATE_SECONDS):
+        return entry['data']
 
-    return processed
+    # Requisições simultâneas para a mesma chave esperam um único download/processamento
+    return upstream_flight.do(('stats',) + key, _build_processed_stats, format_code, rating, month)
+
+
+def _build_processed_stats(format_code, rating, month):
+    key = (format_code, str(rating), month)
+    entry = _processed_memory.get(key)
+    if entry and (is_month_final(month) or time.time() - entry['created'] < CHAOS_REVALIDATE_SECONDS):
+        # Outra chamada terminou de montar este formato enquanto esta aguardava a vez
+        return entry['data']
+
+    # Outro worker (ou uma execução anterior) pode já ter gravado o snapshot binário
+    path = _snapshot_path(month, f"{format_code}-{rating}")
+    loaded = load_snapshot_file(path, None if is_month_final(month) else CHAOS_REVALIDATE_SECONDS)
+    if loaded is not None:
+        snapshot, created = loaded
+    else:
+        snapshot = load_chaos_snapshot(format_code, rating, month)
+        if not snapshot:
+            return None
+        created = time.time()
+        save_snapshot_file(path, snapshot, created)
+
+    data = process_pokemon_data(snapshot)
+
+    # Mês recém-processado (ou ainda fora do histórico) vira linhas da série temporal
+    try:
+        if loaded is None or not usage_history.has_month(format_code, rating, month):
+            usage_history.record(format_code, rating, month, data)
+    except sqlite3.Error as e:
+        print(f"Erro ao gravar histórico {format_code}-{rating} ({month}): {e}")
+
+    # Snapshot compacto + estimativa dos detalhes memorizados sob demanda
+    size = data.snapshot.nbytes + len(data) * PROCESSED_BYTES_PER_POKEMON
+    _processed_memory.put(key, {'data': data, 'created': created}, size)
+    return data
 
 
 def generate_showdown_set(pokemon_data, pokemon_name):
@@ -739,6 +1784,231 @@ def generate_showdown_set(pokemon_data, pokemon_name):
     return '\n'.join(lines)
 
 
+# ==================== ESPELHO LOCAL ====================
+
+MIRROR_JOBS = 4
+# Acima disso os downloads disputariam o pool de conexões do UpstreamClient
+MIRROR_MAX_JOBS = 16
+MIRROR_STALE_TEMP_SECONDS = 60 * 60
+
+
+def check_mirrored_file(format_code, rating, month):
+    """Indica se a cópia em disco está completa e não precisa ser revalidada
+
+    Cópias cujo tamanho não confere com o .meta são apagadas, para serem baixadas
+    do zero (um GET condicional manteria o arquivo corrompido).
+    """
+    path = _chaos_cache_path(format_code, rating, month)
+    meta = read_json_file(path + '.meta')
+    if meta is None or not os.path.exists(path):
+        return False
+    if os.path.getsize(path) != meta.get('size'):
+        for stale in (path + '.meta', path):
+            try:
+                os.unlink(stale)
+            except OSError:
+                pass
+        return False
+    return is_month_final(month) or time.time() - meta.get('validated', 0) < CHAOS_REVALIDATE_SECONDS
+
+
+def mirror_chaos_file(format_code, rating, month):
+    """Garante uma cópia local verificada de um arquivo chaos: 'skipped', 'ok' ou 'failed'"""
+    if check_mirrored_file(format_code, rating, month):
+        return 'skipped'
+    for _ in iter_chaos_chunks(format_code, rating, month):
+        pass
+    return 'ok' if check_mirrored_file(format_code, rating, month) else 'failed'
+
+
+def _remove_stale_temp_files(month):
+    """Apaga downloads temporários deixados por execuções interrompidas"""
+    directory = os.path.join(CACHE_DIR, 'chaos', month)
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if name.startswith('.tmp-') and time.time() - os.path.getmtime(path) > MIRROR_STALE_TEMP_SECONDS:
+                os.unlink(path)
+        except OSError:
+            pass
+
+
+def mirror_stats(months, formats=None, ratings=None, all_formats=False, jobs=MIRROR_JOBS, echo=print):
+    """Baixa uma fatia de {mês}/chaos/ para o cache em disco, em paralelo
+
+    Por padrão espelha os formatos listados no app (FORMATS) com todos os ratings
+    publicados. Pode ser interrompido e executado de novo: arquivos completos são pulados.
+    Retorna um Counter com 'ok', 'skipped' e 'failed'.
+    """
+    app_formats = get_all_formats_flat()
+    tasks = []
+    for month in months:
+        listing = scrape_available_formats_for_month(month)
+        if listing is None:
+            echo(f"{month}: listagem indisponível")
+            continue
+        _remove_stale_temp_files(month)
+        wanted = formats or [code for code in listing if all_formats or code in app_formats]
+        for format_code in wanted:
+            for rating in listing.get(format_code, []):
+                if not ratings or rating in ratings:
+                    tasks.append((format_code, rating, month))
+
+    results = Counter()
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='mirror') as executor:
+        futures = {executor.submit(mirror_chaos_file, *task): task for task in tasks}
+        for done, future in enumerate(as_completed(futures), 1):
+            format_code, rating, month = futures[future]
+            try:
+                status = future.result()
+            except Exception as e:
+                print(f"Erro ao espelhar {month}/{format_code}-{rating}: {e}")
+                status = 'failed'
+            results[status] += 1
+            echo(f"[{done}/{len(tasks)}] {month}/{format_code}-{rating}: {status}")
+    return results
+
+
+@app.cli.command('mirror-stats')
+@click.argument('formats', nargs=-1)
+@click.option('--month', 'months', multiple=True, help='Mês a espelhar (AAAA-MM); pode repetir')
+@click.option('--last', default=1, show_default=True, help='Quantidade de meses mais recentes, se --month não for usado')
+@click.option('--rating', 'ratings', multiple=True, type=int, help='Só estes ratings; pode repetir')
+@click.option('--all', 'all_formats', is_flag=True, help='Todos os formatos publicados, não só os do app')
+@click.option('--jobs', default=MIRROR_JOBS, show_default=True, help='Downloads simultâneos')
+def mirror_stats_command(formats, months, last, ratings, all_formats, jobs):
+    """Baixa os arquivos chaos do Smogon para uso offline (padrão: formatos do app, último mês)"""
+    months = list(months) or scrape_available_months()[:last]
+    if not months:
+        raise click.ClickException('Não foi possível listar os meses do Smogon')
+    results = mirror_stats(months, list(formats) or None, set(ratings) or None, all_formats,
+                           max(1, min(jobs, MIRROR_MAX_JOBS)), echo=click.echo)
+    click.echo(f"{results['ok']} baixados, {results['skipped']} já completos, {results['failed']} falhas")
+    if results['failed']:
+        raise SystemExit(1)
+
+
+# ==================== HISTÓRICO DE USO ====================
+
+HISTORY_MONTHS = 12
+HISTORY_MAX_MONTHS = 36
+HISTORY_TOP_N = 3
+# Campo da resposta -> categoria do chaos guardada (top N) em cada linha do histórico
+HISTORY_TOP_FIELDS = {'moves': 'Moves', 'items': 'Items', 'tera_types': 'Tera Types'}
+
+
+class UsageHistory(SQLiteStore):
+    """Série temporal compacta: uma linha por (formato, espécie, rating, mês)
+
+    Preenchida quando um mês é processado (ver _build_processed_stats), então as
+    tendências são respondidas sem reabrir arquivos chaos antigos.
+    """
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS usage_history ('
+        'format TEXT NOT NULL, species TEXT NOT NULL COLLATE NOCASE, rating TEXT NOT NULL, month TEXT NOT NULL, '
+        'usage REAL NOT NULL, rank INTEGER NOT NULL, raw_count INTEGER NOT NULL, top TEXT NOT NULL, '
+        'PRIMARY KEY (format, species, rating, month)) WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS history_months ('
+        'format TEXT NOT NULL, rating TEXT NOT NULL, month TEXT NOT NULL, '
+        'species_count INTEGER NOT NULL, battles INTEGER, recorded REAL NOT NULL, '
+        'PRIMARY KEY (format, rating, month))',
+    )
+
+    def has_month(self, format_code, rating, month):
+        row = self._connect().execute(
+            'SELECT 1 FROM history_months WHERE format = ? AND rating = ? AND month = ?',
+            (format_code, str(rating), month),
+        ).fetchone()
+        return row is not None
+
+    def record(self, format_code, rating, month, processed):
+        """Grava (ou substitui) as linhas de um mês a partir das stats processadas"""
+        snapshot = processed.snapshot
+        rating = str(rating)
+        rows = []
+        for entry in processed.ranked_list:
+            row = snapshot.row_of(entry['name'])
+            top = {
+                field: calc_percentages(snapshot.pairs(category, row), HISTORY_TOP_N)
+                for field, category in HISTORY_TOP_FIELDS.items()
+            }
+            rows.append((format_code, entry['name'], rating, month, entry['usage'], entry['rank'],
+                         snapshot.raw_count[row], json.dumps(top, separators=(',', ':'))))
+
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Um mês reprocessado pode ter perdido espécies: apaga antes de regravar
+            conn.execute('DELETE FROM usage_history WHERE format = ? AND rating = ? AND month = ?',
+                         (format_code, rating, month))
+            conn.executemany('INSERT INTO usage_history VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            conn.execute(
+                'INSERT OR REPLACE INTO history_months VALUES (?, ?, ?, ?, ?, ?)',
+                (format_code, rating, month, len(rows), processed.info.get('number of battles'), time.time()),
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def recorded_months(self, format_code, ratings=None, limit=HISTORY_MONTHS):
+        """Meses mais recentes gravados para o formato (ordem crescente)"""
+        query = 'SELECT DISTINCT month FROM history_months WHERE format = ?'
+        params = [format_code]
+        if ratings:
+            query += f" AND rating IN ({','.join('?' * len(ratings))})"
+            params.extend(ratings)
+        rows = self._connect().execute(query + ' ORDER BY month DESC LIMIT ?', params + [limit]).fetchall()
+        return sorted(row[0] for row in rows)
+
+    def trend(self, format_code, species, months, ratings=None):
+        """Linhas da espécie nos meses dados: {rating: [ponto por mês]} e o nome canônico"""
+        if not months:
+            return None, {}
+        query = (
+            'SELECT species, rating, month, usage, rank, raw_count, top FROM usage_history '
+            f"WHERE format = ? AND species = ? AND month IN ({','.join('?' * len(months))})"
+        )
+        params = [format_code, species] + list(months)
+        if ratings:
+            query += f" AND rating IN ({','.join('?' * len(ratings))})"
+            params.extend(ratings)
+        series = {}
+        name = None
+        for name, rating, month, usage, rank, raw_count, top in self._connect().execute(query + ' ORDER BY rating, month', params):
+            point = {'month': month, 'usage': usage, 'rank': rank, 'raw_count': raw_count}
+            point.update(json.loads(top))
+            series.setdefault(rating, []).append(point)
+        return name, series
+
+
+usage_history = UsageHistory(os.path.join(CACHE_DIR, 'history.sqlite3'))
+
+
+@app.cli.command('backfill-history')
+@click.argument('formats', nargs=-1, required=True)
+@click.option('--last', default=HISTORY_MONTHS, show_default=True, help='Quantidade de meses mais recentes')
+@click.option('--rating', 'ratings', multiple=True, type=int, help='Só estes ratings; pode repetir')
+def backfill_history_command(formats, last, ratings):
+    """Processa meses anteriores para preencher o histórico de uso (baixa o que faltar)"""
+    months = scrape_available_months()[:last]
+    if not months:
+        raise click.ClickException('Não foi possível listar os meses do Smogon')
+    for month in months:
+        listing = scrape_available_formats_for_month(month) or {}
+        for format_code in formats:
+            for rating in listing.get(format_code, []):
+                if (ratings and rating not in ratings) or usage_history.has_month(format_code, rating, month):
+                    continue
+                status = 'ok' if get_processed_stats(format_code, str(rating), month) else 'failed'
+                click.echo(f"{month}/{format_code}-{rating}: {status}")
+
+
 # ==================== REPLAYS ====================
 
 REPLAY_BASE_URL = "https://replay.pokemonshowdown.com"
@@ -748,7 +2018,7 @@ def fetch_replays(format_code, page=1):
     """Busca replays do Pokemon Showdown"""
     url = f"{REPLAY_BASE_URL}/search.json?format={format_code}&page={page}"
     try:
-        response = requests.get(url, timeout=15)
+        response = upstream.get(url, timeout=15)
         response.raise_for_status()
         return response.json()
     except Exception as e:
@@ -756,11 +2026,27 @@ def fetch_replays(format_code, page=1):
         return []
 
 
+# Ids do Showdown: 'formato-número', com sufixo de senha em replays privados
+REPLAY_ID_PATTERN = re.compile(r'[a-z0-9]+-\d+(?:-[a-z0-9]+)?')
+
+
+def is_valid_replay_id(replay_id):
+    """Só ids válidos viram URLs do servidor de replays e chaves do cache compartilhado"""
+    return isinstance(replay_id, str) and REPLAY_ID_PATTERN.fullmatch(replay_id) is not None
+
+
 def fetch_replay_detail(replay_id):
-    """Busca detalhes de um replay específico"""
+    """Busca detalhes de um replay específico (None para ids inválidos)"""
+    if not is_valid_replay_id(replay_id):
+        return None
+    return upstream_flight.do(('replay', replay_id), _download_replay_detail, replay_id)
+
+
+def download_replay(replay_id):
+    """Baixa um replay do Pokemon Showdown (sem cache)"""
     url = f"{REPLAY_BASE_URL}/{replay_id}.json"
     try:
-        response = requests.get(url, timeout=15)
+        response = upstream.get(url, timeout=15)
         response.raise_for_status()
         return response.json()
     except Exception as e:
@@ -768,70 +2054,186 @@ def fetch_replay_detail(replay_id):
         return None
 
 
-def parse_team_from_log(log, player_num):
-    """Extrai o time de um jogador do log do replay"""
-    team = []
-    player_prefix = f"p{player_num}"
-
-    poke_pattern = rf'\|poke\|{player_prefix}\|([^|]+)\|'
-    poke_matches = re.findall(poke_pattern, log)
-
-    for match in poke_matches:
-        parts = match.split(',')
-        pokemon_name = parts[0].strip()
-        level = 50
-        gender = None
-
-        for part in parts[1:]:
-            part = part.strip()
-            if part.startswith('L'):
-                try:
-                    level = int(part[1:])
-                except:
-                    pass
-            elif part in ['M', 'F']:
-                gender = part
-
-        team.append({
-            'name': pokemon_name,
-            'sprite_name': get_sprite_name(pokemon_name),
-            'level': level,
-            'gender': gender,
-            'item': None,
-            'ability': None,
-            'tera_type': None,
-            'moves': []
-        })
+def _download_replay_detail(replay_id):
+    # O armazém local tem prioridade; ele é alimentado pela ingestão de replays
+    replay = replay_warehouse.get(replay_id)
+    if replay is not None:
+        return replay
 
-    # Extrair abilities
-    ability_pattern = rf'\|-ability\|{player_prefix}[ab]: ([^|]+)\|([^|]+)'
-    ability_matches = re.findall(ability_pattern, log)
-    for nickname, ability in ability_matches:
-        for poke in team:
-            if nickname.lower() in poke['name'].lower() or poke['name'].lower() in nickname.lower():
-                poke['ability'] = ability
-                break
+    # Replays nunca mudam depois de enviados: o cache compartilhado não expira
+    cached = shared_cache.get(f"replay:{replay_id}")
+    if cached is not None:
+        return json.loads(cached[0])
 
-    # Extrair Tera types
-    tera_pattern = rf'\|-terastallize\|{player_prefix}[ab]: ([^|]+)\|([^|]+)'
-    tera_matches = re.findall(tera_pattern, log)
-    for nickname, tera_type in tera_matches:
-        for poke in team:
-            if nickname.lower() in poke['name'].lower() or poke['name'].lower() in nickname.lower():
-                poke['tera_type'] = tera_type
-                break
+    replay = download_replay(replay_id)
+    if replay is None:
+        return None
+
+    shared_cache.set(f"replay:{replay_id}", json.dumps(replay).encode('utf-8'))
+    return replay
+
+
+def _new_team_member(details):
+    """Cria a entrada de um Pokémon a partir dos detalhes do protocolo ('Espécie, L50, M')"""
+    parts = details.split(',')
+    pokemon_name = parts[0].strip()
+    level = 50
+    gender = None
+
+    for part in parts[1:]:
+        part = part.strip()
+        if part.startswith('L'):
+            try:
+                level = int(part[1:])
+            except:
+                pass
+        elif part in ['M', 'F']:
+            gender = part
+
+    return {
+        'name': pokemon_name,
+        'sprite_name': get_sprite_name(pokemon_name),
+        'level': level,
+        'gender': gender,
+        'item': None,
+        'ability': None,
+        'tera_type': None,
+        'moves': []
+    }
 
-    # Extrair moves usados
-    move_pattern = rf'\|move\|{player_prefix}[ab]: ([^|]+)\|([^|]+)'
-    move_matches = re.findall(move_pattern, log)
-    for nickname, move in move_matches:
-        for poke in team:
-            if (nickname.lower() in poke['name'].lower() or poke['name'].lower() in nickname.lower()):
-                if move not in poke['moves'] and len(poke['moves']) < 4:
-                    poke['moves'].append(move)
-                break
 
-    return team
+def _match_team_member(team, species):
+    """Encontra o Pokémon da prévia de time que corresponde à espécie que entrou em campo"""
+    for poke in team:
+        if poke['name'] == species:
+            return poke
+    for poke in team:
+        # 'Urshifu-*' na prévia, ou formas reveladas só em campo (ex.: Zacian -> Zacian-Crowned)
+        base = poke['name'][:-2] if poke['name'].endswith('-*') else poke['name']
+        if species.startswith(base + '-'):
+            if poke['name'].endswith('-*'):
+                poke['name'] = species
+                poke['sprite_name'] = get_sprite_name(species)
+            return poke
+    return None
+
+
+_POKEMON_IDENT = re.compile(r'(p[12])[a-d]?: (.+)')
+# Uma única varredura seleciona só as linhas relevantes do protocolo (o resto do log é pulado pelo regex):
+# eventos de interesse viram (evento, alvo, valor, resto); linhas com '[from] item/ability' vêm inteiras
+_BATTLE_LOG_LINES = re.compile(
+    r'^\|(poke|switch|drag|replace|-ability|-item|-enditem|-terastallize|move)\|([^|\n]*)\|([^|\n]*)(.*)$'
+    r'|^(\|.*\[from\] ?(?:item|ability):.*)$',
+    re.M,
+)
+
+
+def _parse_tags(rest):
+    """Extrai as tags [from] e [of] do final de uma linha do protocolo"""
+    source = None
+    owner_ident = None
+    for part in rest.split('|'):
+        if part.startswith('[from]'):
+            source = part[6:].strip()
+        elif part.startswith('[of]'):
+            owner_ident = part[4:].strip()
+    return source, owner_ident
+
+
+def parse_battle_log(log):
+    """Lê o log do replay uma única vez e retorna {1: time do p1, 2: time do p2}
+
+    Os nicknames são resolvidos pelas linhas |switch|/|drag|/|replace|, que trazem
+    a espécie exata de cada Pokémon em campo.
+    """
+    teams = {'p1': [], 'p2': []}
+    nicknames = {}  # (lado, nickname) -> Pokémon do time
+    idents = {}  # 'p1a: Nickname' -> (lado, nickname)
+
+    def parse_ident(ident):
+        key = idents.get(ident)
+        if key is None:
+            match = _POKEMON_IDENT.match(ident.strip())
+            key = idents[ident] = match.groups() if match else ()
+        return key
+
+    def resolve(ident):
+        return nicknames.get(parse_ident(ident))
+
+    for event, ident, value, rest, tagged_line in _BATTLE_LOG_LINES.findall(log):
+        rest = rest.rstrip('\r')
+        if not event:
+            # Linha de outro evento que revela item/habilidade: '|-heal|p1a: X|..|[from] item: Leftovers'
+            parts = tagged_line.rstrip('\r').split('|')
+            source, owner_ident = _parse_tags('|'.join(parts[3:]))
+            owner = resolve(owner_ident or (parts[2] if len(parts) > 2 else ''))
+            if owner is not None and source:
+                if source.startswith('item: ') and not owner['item']:
+                    owner['item'] = source[6:]
+                elif source.startswith('ability: ') and not owner['ability']:
+                    owner['ability'] = source[9:]
+            continue
+
+        if event == 'poke':
+            if ident in teams:
+                teams[ident].append(_new_team_member(value))
+            continue
+
+        if event in ('switch', 'drag', 'replace'):
+            key = parse_ident(ident)
+            if not key:
+                continue
+            species = value.split(',')[0].strip()
+            poke = _match_team_member(teams[key[0]], species)
+            if poke is None:
+                # Formatos sem prévia de time (ex.: Random Battle) montam o time pelas trocas
+                poke = _new_team_member(value)
+                teams[key[0]].append(poke)
+            nicknames[key] = poke
+            continue
+
+        source, owner_ident = _parse_tags(rest) if '[' in rest else (None, None)
+        poke = resolve(ident)
+
+        if event == '-ability':
+            # '|-ability|p1a: X|Intimidate|[from] ability: Trace' revela que X tem Trace
+            if poke is None:
+                continue
+            if not source:
+                poke['ability'] = value
+            elif source.startswith('ability: ') and not poke['ability']:
+                poke['ability'] = source[9:]
+            continue
+
+        if source:
+            # Tags '[from] item: X' / '[from] ability: X' pertencem ao '[of]' quando presente
+            owner = resolve(owner_ident) if owner_ident else poke
+            if owner is not None:
+                if source.startswith('item: ') and not owner['item']:
+                    owner['item'] = source[6:]
+                elif source.startswith('ability: ') and not owner['ability']:
+                    owner['ability'] = source[9:]
+
+        if poke is None:
+            continue
+        if event == 'move':
+            # Movimentos chamados por outros efeitos (Magic Bounce, Sleep Talk...) não são do set
+            moves = poke['moves']
+            if not source and len(moves) < 4 and value not in moves:
+                moves.append(value)
+        elif event == '-terastallize':
+            poke['tera_type'] = value
+        elif not poke['item']:
+            # Itens obtidos com Trick/Thief não são o item original
+            if not (event == '-item' and source and source.startswith('move: ')):
+                poke['item'] = value
+
+    return {1: teams['p1'], 2: teams['p2']}
+
+
+def parse_team_from_log(log, player_num):
+    """Extrai o time de um jogador do log do replay"""
+    return parse_battle_log(log)[player_num]
 
 
 def generate_team_export(team):
@@ -860,6 +2262,1304 @@ def generate_team_export(team):
     return '\n'.join(lines)
 
 
+# ==================== ARMAZÉM DE REPLAYS ====================
+
+REPLAY_INGEST_INTERVAL = int(os.environ.get('POKESTATS_REPLAY_INGEST_INTERVAL', '0'))
+REPLAY_INGEST_PAGES = 10
+REPLAY_INGEST_WORKERS = 4
+# Por quanto tempo, após a última ingestão de um formato, o armazém é usado para listar replays
+REPLAY_WAREHOUSE_FRESHNESS = max(2 * REPLAY_INGEST_INTERVAL, 30 * 60)
+
+# Pool próprio da ingestão: downloads em background não atrasam /api/replays/batch
+replay_ingest_executor = ThreadPoolExecutor(max_workers=REPLAY_INGEST_WORKERS, thread_name_prefix='replay-ingest')
+
+
+class ReplayWarehouse(SQLiteStore):
+    """Armazém local de replays: SQLite indexado por formato/data, logs comprimidos com zlib"""
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS replays ('
+        'id TEXT PRIMARY KEY, format TEXT NOT NULL, uploadtime INTEGER NOT NULL, rating INTEGER, '
+        'p1 TEXT, p2 TEXT, players TEXT, winner TEXT, views INTEGER, '
+        'log BLOB NOT NULL, team1 TEXT NOT NULL, team2 TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS replays_format_time ON replays (format, uploadtime DESC)',
+        # last_uploadtime: tudo até aqui já foi ingerido; resume_before/pending_uploadtime
+        # guardam o ponto de parada de uma ingestão interrompida pelo limite de páginas
+        'CREATE TABLE IF NOT EXISTS ingest_state ('
+        'format TEXT PRIMARY KEY, last_uploadtime INTEGER NOT NULL DEFAULT 0, '
+        'pending_uploadtime INTEGER, resume_before INTEGER, updated REAL)',
+        'CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires REAL)',
+    )
+
+    def add(self, replay):
+        """Parseia e grava um replay (ignorado se já existir)"""
+        log = replay.get('log', '')
+        teams = parse_battle_log(log)
+        players = replay.get('players') or [replay.get('p1'), replay.get('p2')]
+        self._connect().execute(
+            'INSERT OR IGNORE INTO replays '
+            '(id, format, uploadtime, rating, p1, p2, players, winner, views, log, team1, team2) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                replay['id'], replay.get('formatid') or replay.get('format'), int(replay.get('uploadtime') or 0),
+                replay.get('rating'), replay.get('p1') or players[0], replay.get('p2') or players[1],
+                json.dumps(players), replay.get('winner'), replay.get('views'),
+                zlib.compress(log.encode('utf-8')), json.dumps(teams[1]), json.dumps(teams[2]),
+            ),
+        )
+
+    def existing_ids(self, replay_ids):
+        if not replay_ids:
+            return set()
+        placeholders = ','.join('?' * len(replay_ids))
+        rows = self._connect().execute(f'SELECT id FROM replays WHERE id IN ({placeholders})', list(replay_ids))
+        return {row[0] for row in rows}
+
+    def get(self, replay_id):
+        """Replay no mesmo formato do JSON do Showdown (com 'log'), ou None"""
+        try:
+            row = self._connect().execute(
+                'SELECT id, format, uploadtime, rating, p1, p2, players, winner, views, log '
+                'FROM replays WHERE id = ?', (replay_id,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Erro ao ler armazém de replays: {e}")
+            return None
+        if row is None:
+            return None
+        return {
+            'id': row[0], 'format': row[1], 'uploadtime': row[2], 'rating': row[3],
+            'p1': row[4], 'p2': row[5], 'players': json.loads(row[6] or '[]'),
+            'winner': row[7], 'views': row[8], 'log': zlib.decompress(row[9]).decode('utf-8'),
+        }
+
+    def list_replays(self, format_code, page=1, per_page=20):
+        """Resumo dos replays de um formato, mais recentes primeiro (como o search.json)"""
+        rows = self._connect().execute(
+            'SELECT id, format, uploadtime, rating, p1, p2, players FROM replays '
+            'WHERE format = ? ORDER BY uploadtime DESC LIMIT ? OFFSET ?',
+            (format_code, per_page, (page - 1) * per_page),
+        )
+        return [
+            {'id': row[0], 'format': row[1], 'uploadtime': row[2], 'rating': row[3],
+             'p1': row[4], 'p2': row[5], 'players': json.loads(row[6] or '[]')}
+            for row in rows
+        ]
+
+    def iter_team_rows(self, format_code, since=0):
+        """Gera (team1, team2) ainda em JSON, para agregação fora do processo principal"""
+        rows = self._connect().execute(
+            'SELECT team1, team2 FROM replays WHERE format = ? AND uploadtime >= ?', (format_code, since)
+        )
+        yield from rows
+
+    def get_state(self, format_code):
+        try:
+            row = self._connect().execute(
+                'SELECT last_uploadtime, pending_uploadtime, resume_before, updated FROM ingest_state WHERE format = ?',
+                (format_code,),
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Erro ao ler armazém de replays: {e}")
+            row = None
+        if row is None:
+            return {'last_uploadtime': 0, 'pending_uploadtime': None, 'resume_before': None, 'updated': None}
+        return dict(zip(('last_uploadtime', 'pending_uploadtime', 'resume_before', 'updated'), row))
+
+    def set_state(self, format_code, last_uploadtime, pending_uploadtime, resume_before):
+        self._connect().execute(
+            'INSERT OR REPLACE INTO ingest_state '
+            '(format, last_uploadtime, pending_uploadtime, resume_before, updated) VALUES (?, ?, ?, ?, ?)',
+            (format_code, last_uploadtime, pending_uploadtime, resume_before, time.time()),
+        )
+
+    def acquire_lease(self, name, owner, seconds):
+        """Tenta obter um lease exclusivo entre workers; True se este dono ficou com ele"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute('INSERT OR IGNORE INTO leases (name, owner, expires) VALUES (?, NULL, 0)', (name,))
+        updated = conn.execute(
+            'UPDATE leases SET owner = ?, expires = ? WHERE name = ? AND (expires < ? OR owner = ?)',
+            (owner, now + seconds, name, now, owner),
+        ).rowcount
+        return updated == 1
+
+
+replay_warehouse = ReplayWarehouse(os.path.join(CACHE_DIR, 'replays.sqlite3'))
+
+
+def _search_replays(format_code, before=None):
+    url = f"{REPLAY_BASE_URL}/search.json?format={format_code}"
+    if before:
+        url += f"&before={before}"
+    response = upstream.get(url, timeout=15)
+    response.raise_for_status()
+    return response.json()
+
+
+def ingest_replays(format_code, max_pages=REPLAY_INGEST_PAGES):
+    """Busca replays novos de um formato e grava no armazém; retorna quantos foram adicionados
+
+    Pagina o search.json do mais novo para o mais antigo até chegar ao último uploadtime
+    já ingerido. Se o limite de páginas for atingido antes, a próxima execução continua dali.
+    """
+    state = replay_warehouse.get_state(format_code)
+    last = state['last_uploadtime']
+    newest = state['pending_uploadtime'] or last
+    before = state['resume_before']
+    added = 0
+
+    for _ in range(max_pages):
+        results = _search_replays(format_code, before)
+        # O search.json devolve 51 itens quando existe uma próxima página
+        page = [replay for replay in results[:50] if replay.get('uploadtime')]
+        fresh = [replay for replay in page if replay['uploadtime'] > last]
+        if fresh:
+            newest = max(newest, max(replay['uploadtime'] for replay in fresh))
+
+        known = replay_warehouse.existing_ids([replay['id'] for replay in fresh])
+        to_fetch = [replay['id'] for replay in fresh if replay['id'] not in known]
+        for replay in replay_ingest_executor.map(download_replay, to_fetch):
+            if replay and replay.get('id'):
+                replay_warehouse.add(replay)
+                added += 1
+
+        if len(results) <= 50 or len(fresh) < len(page):
+            # Chegou ao fim da lista ou ao que já estava ingerido
+            replay_warehouse.set_state(format_code, newest, None, None)
+            return added
+        before = page[-1]['uploadtime']
+
+    replay_warehouse.set_state(format_code, last, newest, before)
+    return added
+
+
+def ingest_all_replays(format_codes=None, max_pages=REPLAY_INGEST_PAGES):
+    """Ingestão de vários formatos (por padrão, todos de FORMATS)"""
+    total = 0
+    for format_code in format_codes or list(get_all_formats_flat()):
+        try:
+            added = ingest_replays(format_code, max_pages)
+        except Exception as e:
+            print(f"Erro ao ingerir replays de {format_code}: {e}")
+            continue
+        if added:
+            print(f"{format_code}: {added} replays novos")
+        total += added
+    return total
+
+
+class ReplayIngestJob:
+    """Ingestão periódica em background; um lease no SQLite garante um único worker por vez"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if not self.interval:
+            return
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='replay-ingest', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        owner = f"{os.getpid()}"
+        while True:
+            try:
+                if replay_warehouse.acquire_lease('replay-ingest', owner, self.interval):
+                    ingest_all_replays()
+            except Exception as e:
+                print(f"Erro na ingestão de replays: {e}")
+            time.sleep(self.interval)
+
+
+replay_ingest_job = ReplayIngestJob(REPLAY_INGEST_INTERVAL)
+
+
+@app.before_request
+def start_background_jobs():
+    replay_ingest_job.ensure_started()
+
+
+@app.cli.command('ingest-replays')
+@click.argument('formats', nargs=-1)
+@click.option('--pages', default=REPLAY_INGEST_PAGES, show_default=True, help='Máximo de páginas por formato')
+def ingest_replays_command(formats, pages):
+    """Baixa replays novos para o armazém local (padrão: todos os formatos)"""
+    total = ingest_all_replays(list(formats) or None, pages)
+    click.echo(f"{total} replays adicionados")
+
+
+# ==================== STATS A PARTIR DE REPLAYS ====================
+
+REPLAY_STATS_DEFAULT_DAYS = 7
+REPLAY_STATS_MAX_DAYS = 90
+REPLAY_STATS_TTL = 15 * 60
+REPLAY_STATS_SHARD_SIZE = 500
+REPLAY_STATS_CATEGORIES = {'item': 'Items', 'ability': 'Abilities', 'tera_type': 'Tera Types'}
+
+# Processos de agregação por worker: os CPUs são divididos entre os workers do gunicorn
+# (WEB_CONCURRENCY, que o gunicorn também usa como número de workers)
+USAGE_WORKERS = int(os.environ.get('POKESTATS_USAGE_WORKERS', '0')) or max(
+    1, (os.cpu_count() or 2) // max(1, int(os.environ.get('WEB_CONCURRENCY', '1'))))
+
+_usage_pool = None
+_usage_pool_lock = threading.Lock()
+
+
+def _get_usage_pool():
+    """Pool de processos para a agregação (criado sob demanda e reaproveitado)"""
+    global _usage_pool
+    with _usage_pool_lock:
+        if _usage_pool is None:
+            # 'spawn' evita fazer fork de um worker com várias threads ativas
+            _usage_pool = ProcessPoolExecutor(
+                max_workers=USAGE_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _usage_pool
+
+
+def _count_replay_shard(replays):
+    """Contagens parciais de um lote de replays; roda nos processos do pool
+
+    Cada item é um log de batalha (texto) ou um par (team1, team2) em JSON, como
+    o armazém guarda depois de parsear o log na ingestão.
+    """
+    counts = {
+        'teams': 0,
+        'species': Counter(),
+        'pairs': Counter(),
+        'Moves': defaultdict(Counter),
+        'Items': defaultdict(Counter),
+        'Abilities': defaultdict(Counter),
+        'Tera Types': defaultdict(Counter),
+    }
+    species, pairs, moves = counts['species'], counts['pairs'], counts['Moves']
+    fields = [(field, counts[category]) for field, category in REPLAY_STATS_CATEGORIES.items()]
+    # += direto evita o custo por chamada de Counter.update() em listas curtas
+    for replay in replays:
+        if isinstance(replay, str):
+            teams = parse_battle_log(replay).values()
+        else:
+            teams = [json.loads(team) for team in replay]
+        for team in teams:
+            if not team:
+                continue
+            counts['teams'] += 1
+            names = sorted({poke['name'] for poke in team})
+            for i, name in enumerate(names):
+                species[name] += 1
+                for mate in names[i + 1:]:
+                    pairs[name, mate] += 1
+            for poke in team:
+                name = poke['name']
+                for field, column in fields:
+                    value = poke[field]
+                    if value:
+                        column[name][value] += 1
+                counter = moves[name]
+                for move in poke['moves']:
+                    counter[move] += 1
+    return counts
+
+
+def _merge_counts(total, partial):
+    total['teams'] += partial['teams']
+    total['species'].update(partial['species'])
+    total['pairs'].update(partial['pairs'])
+    for category in ('Moves', 'Items', 'Abilities', 'Tera Types'):
+        for name, counter in partial[category].items():
+            total[category][name].update(counter)
+    return total
+
+
+def compute_replay_usage(format_code, days=REPLAY_STATS_DEFAULT_DAYS, replays=None):
+    """Stats estilo Smogon (JSON chaos) calculadas a partir de replays
+
+    Sem `replays`, usa os times já parseados do armazém nos últimos `days` dias.
+    Os replays são divididos em lotes processados em paralelo e as contagens
+    parciais são somadas. 'Teammates' segue o Smogon: P(parceiro | Pokémon) - uso do parceiro.
+    """
+    if replays is None:
+        since = int(time.time()) - days * 24 * 60 * 60
+        replays = list(replay_warehouse.iter_team_rows(format_code, since))
+    if not replays:
+        return None
+
+    shards = [replays[i:i + REPLAY_STATS_SHARD_SIZE] for i in range(0, len(replays), REPLAY_STATS_SHARD_SIZE)]
+    if len(shards) == 1 or (os.cpu_count() or 1) == 1:
+        partials = map(_count_replay_shard, shards)
+    else:
+        partials = _get_usage_pool().map(_count_replay_shard, shards)
+
+    counts = _count_replay_shard([])
+    for partial in partials:
+        _merge_counts(counts, partial)
+
+    teams = counts['teams']
+    if not teams:
+        return None
+    species = counts['species']
+    teammates = defaultdict(dict)
+    for (name, mate), together in counts['pairs'].items():
+        teammates[name][mate] = together / species[name] - species[mate] / teams
+        teammates[mate][name] = together / species[mate] - species[name] / teams
+
+    data = {}
+    for name, count in species.most_common():
+        data[name] = {
+            'usage': count / teams,
+            'Raw count': count,
+            'Abilities': dict(counts['Abilities'].get(name, {})),
+            'Items': dict(counts['Items'].get(name, {})),
+            'Moves': dict(counts['Moves'].get(name, {})),
+            'Tera Types': dict(counts['Tera Types'].get(name, {})),
+            'Teammates': teammates.get(name, {}),
+        }
+    info = {
+        'metagame': format_code,
+        'number of battles': len(replays),
+        'source': 'replays',
+        'days': days,
+    }
+    return {'info': info, 'data': data}
+
+
+def get_replay_stats(format_code, days=REPLAY_STATS_DEFAULT_DAYS):
+    """Stats processadas dos replays recentes de um formato (com cache) ou None"""
+    key = ('replays', format_code, days)
+    entry = _processed_memory.get(key)
+    if entry and time.time() - entry['created'] < REPLAY_STATS_TTL:
+        return entry['data']
+    return upstream_flight.do(key, _build_replay_stats, format_code, days)
+
+
+def _build_replay_stats(format_code, days):
+    key = ('replays', format_code, days)
+    path = _snapshot_path('replays', f"{format_code}-{days}d")
+    loaded = load_snapshot_file(path, REPLAY_STATS_TTL)
+    if loaded is not None:
+        snapshot, created = loaded
+    else:
+        raw = compute_replay_usage(format_code, days)
+        if not raw:
+            return None
+        snapshot = ChaosSnapshot.from_json(raw)
+        created = time.time()
+        save_snapshot_file(path, snapshot, created)
+
+    data = process_pokemon_data(snapshot)
+    size = snapshot.nbytes + len(data) * PROCESSED_BYTES_PER_POKEMON
+    _processed_memory.put(key, {'data': data, 'created': created}, size)
+    return data
+
+
+# ==================== COBERTURA DE TIPOS ====================
+
+TEAM_SIZE = 6
+TEAM_COVERAGE_MAX_TEAMS = 500
+
+# Coluna extra de 1s: "sem tipo", usada no segundo tipo de monotipos e em vagas vazias do time
+_NO_TYPE = len(TYPES)
+_DEFENSE_CHART = np.hstack([TYPE_CHART, np.ones((len(TYPES), 1))])
+
+# Todos os defensores possíveis (monotipos e pares de tipos): efetividade (18, 171)
+_DEFENDER_TYPES = np.array([(a, b) for a in range(len(TYPES)) for b in range(a, len(TYPES))])
+_DEFENDER_CHART = _DEFENSE_CHART[:, _DEFENDER_TYPES[:, 0]] * np.where(
+    _DEFENDER_TYPES[:, 0] == _DEFENDER_TYPES[:, 1], 1, TYPE_CHART[:, _DEFENDER_TYPES[:, 1]]
+)
+
+
+def _parse_type(name, allow_stellar=False):
+    """Nome de tipo normalizado ('fire' -> 'Fire'); ValueError se não existir"""
+    normalized = str(name).strip().capitalize()
+    if normalized in TYPE_INDEX or (allow_stellar and normalized == 'Stellar'):
+        return normalized
+    raise ValueError(f'Tipo inválido: {name}')
+
+
+def parse_coverage_member(member, use_tera=False):
+    """Normaliza um membro do time: lista de tipos ou {'types', 'tera_type', 'attack_types'}
+
+    Retorna (tipos defensivos, tipos de ataque, dict normalizado). Com `use_tera`,
+    a Tera substitui os tipos na defesa (exceto Stellar) e vira STAB no ataque.
+    """
+    if isinstance(member, dict):
+        types = member.get('types') or []
+        tera = member.get('tera_type')
+        attack = member.get('attack_types')
+    else:
+        types, tera, attack = member, None, None
+
+    if isinstance(types, str):
+        types = [types]
+    if isinstance(attack, str):
+        attack = [attack]
+    if not isinstance(types, list) or not isinstance(attack or [], list):
+        raise ValueError('Tipos devem ser informados como lista')
+    types = list(dict.fromkeys(_parse_type(t) for t in types))
+    if not 1 <= len(types) <= 2:
+        raise ValueError('Cada Pokémon precisa de 1 ou 2 tipos')
+    tera = _parse_type(tera, allow_stellar=True) if tera else None
+    attack = [_parse_type(t) for t in attack] if attack else list(types)
+
+    defensive = types
+    if use_tera and tera:
+        if tera != 'Stellar':
+            defensive = [tera]
+            attack.append(tera)
+    attack = list(dict.fromkeys(attack))
+
+    normalized = {'types': types, 'tera_type': tera, 'defensive_types': defensive, 'attack_types': attack}
+    return defensive, attack, normalized
+
+
+def encode_teams(teams, use_tera=False):
+    """Converte times em arrays para o cálculo em lote
+
+    Retorna (defesa (B, 6, 2) com índices de tipo, ataque (B, 6, 18) booleano,
+    presença (B, 6) booleano, membros normalizados por time).
+    """
+    defense = np.full((len(teams), TEAM_SIZE, 2), _NO_TYPE, dtype=np.intp)
+    attack = np.zeros((len(teams), TEAM_SIZE, len(TYPES)), dtype=bool)
+    present = np.zeros((len(teams), TEAM_SIZE), dtype=bool)
+    members = []
+    for t, team in enumerate(teams):
+        if not isinstance(team, list) or not 1 <= len(team) <= TEAM_SIZE:
+            raise ValueError(f'Cada time precisa ter de 1 a {TEAM_SIZE} Pokémon')
+        normalized_team = []
+        for m, member in enumerate(team):
+            defensive, attack_types, normalized = parse_coverage_member(member, use_tera)
+            defense[t, m, :len(defensive)] = [TYPE_INDEX[x] for x in defensive]
+            attack[t, m, [TYPE_INDEX[x] for x in attack_types]] = True
+            present[t, m] = True
+            normalized_team.append(normalized)
+        members.append(normalized_team)
+    return defense, attack, present, members
+
+
+def team_coverage(defense, attack, present):
+    """Cobertura defensiva e ofensiva de B times numa única passada vetorizada
+
+    - multipliers (B, 6, 18): dano recebido por cada membro de cada tipo atacante
+    - weak/resist/immune (B, 18): quantos membros são fracos/resistem/imunes a cada tipo
+    - best (B, 18): melhor multiplicador do time contra cada tipo defensor puro
+    - dual_coverage (B,): fração de todos os defensores (monotipos e pares) atingidos com x2 ou mais
+    """
+    # (18, B, 6, 2) -> produto dos dois tipos -> (B, 6, 18)
+    multipliers = np.moveaxis(_DEFENSE_CHART[:, defense].prod(axis=-1), 0, -1)
+    mask = present[..., None]
+    weak = ((multipliers > 1) & mask).sum(axis=1)
+    resist = ((multipliers < 1) & (multipliers > 0) & mask).sum(axis=1)
+    immune = ((multipliers == 0) & mask).sum(axis=1)
+
+    # Tipos de ataque disponíveis no time inteiro (B, 18) e o melhor golpe contra cada defensor
+    team_attack = attack.any(axis=1)[..., None]
+    best = np.where(team_attack, TYPE_CHART, 0).max(axis=1)
+    dual_best = np.where(team_attack, _DEFENDER_CHART, 0).max(axis=1)
+    dual_coverage = (dual_best > 1).mean(axis=1)
+
+    return {
+        'multipliers': multipliers,
+        'weak': weak,
+        'resist': resist,
+        'immune': immune,
+        'best': best,
+        'dual_coverage': dual_coverage,
+    }
+
+
+def coverage_to_dict(coverage, index, members):
+    """Resultado de um time (posição `index` do lote) em formato JSON"""
+    multipliers = coverage['multipliers'][index].tolist()
+    weak = coverage['weak'][index].tolist()
+    resist = coverage['resist'][index].tolist()
+    immune = coverage['immune'][index].tolist()
+    best = coverage['best'][index].tolist()
+
+    return {
+        'members': [
+            dict(member, multipliers=dict(zip(TYPES, multipliers[m])))
+            for m, member in enumerate(members)
+        ],
+        'defensive': {
+            t: {'weak': weak[i], 'resist': resist[i], 'immune': immune[i]}
+            for i, t in enumerate(TYPES)
+        },
+        # Tipos que acertam mais membros com x2 do que membros que resistem ou são imunes
+        'weaknesses': [t for i, t in enumerate(TYPES) if weak[i] > resist[i] + immune[i]],
+        'offensive': {
+            'best': dict(zip(TYPES, best)),
+            'super_effective': [t for i, t in enumerate(TYPES) if best[i] > 1],
+            'uncovered': [t for i, t in enumerate(TYPES) if best[i] <= 1],
+            'dual_type_coverage': round(float(coverage['dual_coverage'][index]) * 100, 2),
+        },
+    }
+
+
+# ==================== ÍNDICE DE CHECKS ====================
+
+CHECKS_QUERY_LIMIT = 20
+
+
+class ChecksIndex:
+    """Índices de Checks and Counters de um snapshot, em listas ordenadas por id de espécie
+
+    - by_threat: ameaça -> espécies que a verificam (com score)
+    - by_checker: espécie -> ameaças que ela verifica (o índice invertido)
+    """
+
+    def __init__(self, snapshot):
+        self.species = snapshot.tables['species']
+        column = snapshot.columns['Checks and Counters']
+        offsets = np.frombuffer(column.offsets, dtype=np.uint32).astype(np.int64)
+        checkers = np.frombuffer(column.ids, dtype=np.uint32).astype(np.int64)
+        scores = np.frombuffer(column.values, dtype=np.float64)
+        row_species = np.frombuffer(snapshot.row_species, dtype=np.uint32).astype(np.int64)
+        threats = row_species[np.repeat(np.arange(len(snapshot)), np.diff(offsets))]
+
+        self.by_threat = self._postings(threats, checkers, scores)
+        self.by_checker = self._postings(checkers, threats, scores)
+
+    def _postings(self, keys, ids, scores):
+        """Agrupa (chave, id, score) em formato CSR com cada lista ordenada por id"""
+        order = np.lexsort((ids, keys))
+        offsets = np.searchsorted(keys[order], np.arange(len(self.species) + 1))
+        return offsets, ids[order], scores[order]
+
+    def _posting(self, index, species_name):
+        offsets, ids, scores = index
+        species_id = self.species.ids.get(species_name)
+        if species_id is None:
+            return ids[:0], scores[:0]
+        start, end = offsets[species_id], offsets[species_id + 1]
+        return ids[start:end], scores[start:end]
+
+    def checks_for(self, threats, limit=CHECKS_QUERY_LIMIT):
+        """Espécies que verificam todas as ameaças (interseção das listas); score = o menor entre elas"""
+        postings = sorted(
+            ((threat,) + self._posting(self.by_threat, threat) for threat in threats),
+            key=lambda posting: len(posting[1]),
+        )
+        _, ids, scores = postings[0]
+        matched = {postings[0][0]: scores}
+        # Começa pela lista mais curta: cada interseção só encolhe o conjunto
+        for threat, other_ids, other_scores in postings[1:]:
+            ids, left, right = np.intersect1d(ids, other_ids, assume_unique=True, return_indices=True)
+            matched = {name: values[left] for name, values in matched.items()}
+            matched[threat] = other_scores[right]
+
+        worst = np.min(np.vstack(list(matched.values())), axis=0) if len(ids) else scores[:0]
+        best = np.argsort(-worst, kind='stable')[:limit]
+        return [
+            {
+                'name': self.species[int(ids[i])],
+                'score': round(float(worst[i]), 2),
+                'scores': {threat: round(float(matched[threat][i]), 2) for threat in threats},
+            }
+            for i in best
+        ]
+
+    def checked_by(self, checker, limit=CHECKS_QUERY_LIMIT):
+        """Ameaças que `checker` verifica, da mais bem verificada para a menos"""
+        ids, scores = self._posting(self.by_checker, checker)
+        best = np.argsort(-scores, kind='stable')[:limit]
+        return [{'name': self.species[int(ids[i])], 'score': round(float(scores[i]), 2)} for i in best]
+
+
+# ==================== BUSCA ====================
+
+SEARCH_LIMIT = 10
+SEARCH_MIN_SIMILARITY = 0.4
+# Tipo de resultado -> categoria do chaos (espécies vêm das linhas do snapshot)
+SEARCH_CATEGORIES = {'move': 'Moves', 'item': 'Items', 'ability': 'Abilities'}
+SEARCH_KINDS = ('species',) + tuple(SEARCH_CATEGORIES)
+
+
+def _search_tokens(text):
+    """'Urshifu-Rapid-Strike' -> ['urshifu', 'rapid', 'strike']"""
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Índice de busca de um snapshot (espécies, golpes, itens e habilidades)
+
+    Casamento por prefixo de cada palavra ('urshifu rapid' -> Urshifu-Rapid-Strike) ou do
+    nome compacto ('fake out' -> fakeout), com busca binária em listas ordenadas. Se sobrar
+    espaço no resultado, completa com casamento aproximado por trigramas (erros de digitação).
+    """
+
+    def __init__(self, snapshot):
+        usage = np.frombuffer(snapshot.usage, dtype=np.float64)
+        # (tipo, nome, peso): espécies pesam pelo uso; o resto pelo uso de quem as utiliza
+        self.entries = [('species', name, float(weight)) for name, weight in zip(snapshot.species_names(), usage)]
+        for kind, category in SEARCH_CATEGORIES.items():
+            column = snapshot.columns[category]
+            table = snapshot.tables[CHAOS_COLUMNS[category]]
+            offsets = np.frombuffer(column.offsets, dtype=np.uint32)
+            ids = np.frombuffer(column.ids, dtype=np.uint32)
+            weights = np.bincount(ids, weights=np.repeat(usage, np.diff(offsets)), minlength=len(table))
+            self.entries.extend((kind, name, float(weight)) for name, weight in zip(table.strings, weights))
+
+        tokens = []
+        self.compact = []
+        self.grams = defaultdict(list)
+        self.gram_counts = []
+        for entry_id, (_, name, _) in enumerate(self.entries):
+            parts = _search_tokens(name)
+            tokens.extend((part, entry_id) for part in set(parts))
+            key = ''.join(parts)
+            self.compact.append(key)
+            grams = _trigrams(key)
+            self.gram_counts.append(len(grams))
+            for gram in grams:
+                self.grams[gram].append(entry_id)
+
+        tokens.sort()
+        self.token_keys = [token for token, _ in tokens]
+        self.token_ids = [entry_id for _, entry_id in tokens]
+        compact = sorted((key, entry_id) for entry_id, key in enumerate(self.compact))
+        self.compact_keys = [key for key, _ in compact]
+        self.compact_ids = [entry_id for _, entry_id in compact]
+
+    @staticmethod
+    def _prefix(keys, ids, prefix):
+        """Ids cujas chaves começam com `prefix` (chaves só têm [a-z0-9], então '~' fecha o intervalo)"""
+        return set(ids[bisect.bisect_left(keys, prefix):bisect.bisect_left(keys, prefix + '~')])
+
+    def search(self, query, limit=SEARCH_LIMIT, kinds=SEARCH_KINDS):
+        """Melhores resultados: nome exato > prefixo do nome > prefixo das palavras > aproximado"""
+        parts = _search_tokens(query)
+        if not parts:
+            return []
+        key = ''.join(parts)
+
+        matches = self._prefix(self.compact_keys, self.compact_ids, key)
+        by_token = None
+        for part in sorted(set(parts), key=len, reverse=True):
+            found = self._prefix(self.token_keys, self.token_ids, part)
+            by_token = found if by_token is None else by_token & found
+            if not by_token:
+                break
+        matches |= by_token
+
+        scored = {}
+        for entry_id in matches:
+            kind, _, weight = self.entries[entry_id]
+            if kind in kinds:
+                compact = self.compact[entry_id]
+                quality = 3 if compact == key else 2 if compact.startswith(key) else 1
+                scored[entry_id] = (quality, weight)
+
+        if len(scored) < limit:
+            grams = _trigrams(key)
+            hits = Counter()
+            for gram in grams:
+                hits.update(self.grams.get(gram, ()))
+            for entry_id, shared in hits.items():
+                kind, _, weight = self.entries[entry_id]
+                if entry_id in scored or kind not in kinds:
+                    continue
+                similarity = 2 * shared / (len(grams) + self.gram_counts[entry_id])
+                if similarity >= SEARCH_MIN_SIMILARITY:
+                    scored[entry_id] = (similarity, weight)
+
+        best = heapq.nlargest(limit, scored.items(), key=lambda item: item[1])
+        return [
+            {'kind': self.entries[entry_id][0], 'name': self.entries[entry_id][1], 'fuzzy': quality < 1}
+            for entry_id, (quality, _) in best
+        ]
+
+
+# ==================== MONTADOR DE TIMES ====================
+
+TEAM_BUILDER_THREATS = 30
+TEAM_BUILDER_CANDIDATES = 150
+TEAM_BUILDER_BEAM_WIDTH = 24
+TEAM_BUILDER_CHECKS_WEIGHT = 0.5
+TEAM_BUILDER_MAX_CHECKS_WEIGHT = 10
+TEAM_BUILDER_BUDGET_MS = 150
+TEAM_BUILDER_RESULTS = 5
+
+
+def _base_species(name):
+    """Espécie base para a cláusula de espécie ('Urshifu-Rapid-Strike' -> 'Urshifu')"""
+    return name.split('-')[0]
+
+
+class TeamBuilderModel:
+    """Dados de um snapshot preparados para a busca de times
+
+    - parceiros: matriz esparsa (CSR) simétrica com a média de Teammates[a][b] e [b][a]
+    - checks: matriz densa (ameaças x espécies) com o score de Checks and Counters em [0, 1]
+    """
+
+    def __init__(self, snapshot):
+        self.names = snapshot.species_names()
+        size = len(self.names)
+        species_row = snapshot.species_row
+        self.row_of = {name: row for row, name in enumerate(self.names)}
+        self.usage = np.frombuffer(snapshot.usage, dtype=np.float64).copy() if size else np.zeros(0)
+
+        # Teammates: ids da tabela de espécies -> linhas; parceiros sem linha própria são descartados
+        column = snapshot.columns['Teammates']
+        offsets = np.frombuffer(column.offsets, dtype=np.uint32).astype(np.int64)
+        ids = np.frombuffer(column.ids, dtype=np.uint32)
+        values = np.frombuffer(column.values, dtype=np.float64)
+        id_to_row = np.full(len(snapshot.tables['species']), -1, dtype=np.int64)
+        for species_id, row in species_row.items():
+            id_to_row[species_id] = row
+        rows = np.repeat(np.arange(size), np.diff(offsets))
+        cols = id_to_row[ids] if len(ids) else np.zeros(0, dtype=np.int64)
+        known = cols >= 0
+        rows, cols, values = rows[known], cols[known], values[known]
+
+        # Simetriza somando (a, b) e (b, a) e agregando as duplicatas
+        stride = max(size, 1)
+        keys = np.concatenate([rows * stride + cols, cols * stride + rows])
+        keys, inverse = np.unique(keys, return_inverse=True)
+        sums = np.bincount(inverse, weights=np.concatenate([values, values]) / 2, minlength=len(keys))
+        self.indices = keys % stride
+        self.indptr = np.searchsorted(keys // stride, np.arange(size + 1))
+        self.data = sums
+
+        # Ameaças: espécies mais usadas; checks = score de quem as verifica
+        self.threats = np.argsort(-self.usage, kind='stable')[:TEAM_BUILDER_THREATS]
+        self.threat_weights = self.usage[self.threats]
+        self.checks = np.zeros((len(self.threats), size))
+        for t, row in enumerate(self.threats):
+            for name, score in snapshot.pairs('Checks and Counters', int(row)):
+                checker = self.row_of.get(name)
+                if checker is not None:
+                    self.checks[t, checker] = min(max(score, 0), 1)
+
+        self.candidates = np.argsort(-self.usage, kind='stable')[:TEAM_BUILDER_CANDIDATES]
+        self.bases = [_base_species(name) for name in self.names]
+
+    def synergy_row(self, row):
+        """Linha densa da matriz de parceiros"""
+        dense = np.zeros(len(self.names))
+        start, end = self.indptr[row], self.indptr[row + 1]
+        dense[self.indices[start:end]] = self.data[start:end]
+        return dense
+
+    def _state(self, members):
+        """Estado da busca: soma das linhas de parceiros, soma dos pares e melhor check por ameaça"""
+        synergy = np.zeros(len(self.names))
+        pair_sum = 0.0
+        cover = np.zeros(len(self.threats))
+        for member in members:
+            pair_sum += synergy[member]
+            synergy += self.synergy_row(member)
+            cover = np.maximum(cover, self.checks[:, member])
+        return {'members': tuple(members), 'synergy': synergy, 'pair_sum': pair_sum, 'cover': cover}
+
+    def _expand(self, state, width, checks_weight):
+        """Melhores `width` filhos de um estado, avaliando todos os candidatos de uma vez"""
+        members = state['members']
+        taken = {self.bases[m] for m in members}
+        candidates = np.array([c for c in self.candidates if self.bases[c] not in taken], dtype=np.int64)
+        if not len(candidates):
+            return []
+
+        pairs = (len(members) + 1) * len(members) / 2
+        synergy = (state['pair_sum'] + state['synergy'][candidates]) / pairs
+        cover = np.maximum(state['cover'][:, None], self.checks[:, candidates])
+        coverage = self.threat_weights @ cover / max(self.threat_weights.sum(), 1e-12)
+        scores = synergy + checks_weight * coverage
+
+        if len(candidates) > width:
+            best = np.argpartition(-scores, width)[:width]
+        else:
+            best = np.arange(len(candidates))
+
+        children = []
+        for i in best:
+            row = int(candidates[i])
+            children.append({
+                'members': members + (row,),
+                'synergy': state['synergy'] + self.synergy_row(row),
+                'pair_sum': state['pair_sum'] + state['synergy'][row],
+                'cover': cover[:, i],
+                'score': float(scores[i]),
+            })
+        return children
+
+    def suggest(self, locked, results=TEAM_BUILDER_RESULTS, beam_width=TEAM_BUILDER_BEAM_WIDTH,
+                checks_weight=TEAM_BUILDER_CHECKS_WEIGHT, budget_ms=TEAM_BUILDER_BUDGET_MS):
+        """Beam search a partir dos Pokémon fixos; retorna (times completos, se estourou o orçamento)
+
+        Quando o orçamento de tempo acaba, os estados restantes são completados de forma
+        gulosa (largura 1), então sempre há resposta.
+        """
+        deadline = time.perf_counter() + budget_ms / 1000
+        beam = [self._state([self.row_of[name] for name in locked])]
+        truncated = False
+
+        while len(beam[0]['members']) < TEAM_SIZE:
+            width = beam_width
+            if time.perf_counter() > deadline:
+                truncated = True
+                width = 1
+            children = {}
+            for state in beam:
+                for child in self._expand(state, width, checks_weight):
+                    key = frozenset(child['members'])
+                    if key not in children or children[key]['score'] < child['score']:
+                        children[key] = child
+            if not children:
+                break
+            beam = heapq.nlargest(beam_width if width > 1 else len(beam), children.values(),
+                                  key=lambda state: state['score'])
+
+        return [self.describe(state, checks_weight) for state in beam[:results]], truncated
+
+    def describe(self, state, checks_weight=TEAM_BUILDER_CHECKS_WEIGHT):
+        members = state['members']
+        pairs = max(len(members) * (len(members) - 1) / 2, 1)
+        synergy = state['pair_sum'] / pairs
+        coverage = float(self.threat_weights @ state['cover'] / max(self.threat_weights.sum(), 1e-12))
+        return {
+            'members': [self.names[m] for m in members],
+            'score': round(synergy + checks_weight * coverage, 4),
+            'synergy': round(float(synergy) * 100, 2),
+            'checks_coverage': round(coverage * 100, 2),
+            'unchecked_threats': [
+                self.names[t] for t, best in zip(self.threats, state['cover']) if best == 0
+            ],
+        }
+
+
+# ==================== VARIAÇÃO ENTRE MESES ====================
+
+DELTA_TOP_SPECIES = 20
+DELTA_MAX_SPECIES = 100
+DELTA_TOP_SHIFTS = 5
+# Mudanças de set menores que isto (em pontos percentuais) são ignoradas
+DELTA_MIN_SHIFT = 0.5
+# Só espécies com pelo menos este uso (%) em um dos lados recebem mudanças de set
+DELTA_MIN_USAGE = 1.0
+# Campo da resposta -> categoria do chaos comparada por espécie
+DELTA_SHIFT_FIELDS = {'moves': 'Moves', 'items': 'Items', 'tera_types': 'Tera Types'}
+
+
+def _union_ids(union, table):
+    """Ids de `table` (StringTable) no espaço comum `union` (dict string -> id), ampliando-o"""
+    return np.fromiter((union.setdefault(value, len(union)) for value in table.strings),
+                       dtype=np.int64, count=len(table))
+
+
+def _row_species(snapshot, species_ids):
+    """Id comum da espécie de cada linha do snapshot"""
+    return species_ids[np.frombuffer(snapshot.row_species, dtype=np.uint32)]
+
+
+def _category_shares(snapshot, category, row_ids, option_ids):
+    """Participação (%) de cada opção da categoria por linha: (espécie, opção, %)
+
+    Mesma conta de calc_percentages (valor / total da linha), feita de uma vez para
+    todas as linhas.
+    """
+    column = snapshot.columns[category]
+    offsets = np.frombuffer(column.offsets, dtype=np.uint32).astype(np.int64)
+    ids = np.frombuffer(column.ids, dtype=np.uint32)
+    values = np.frombuffer(column.values, dtype=np.float64)
+    rows = np.repeat(np.arange(len(snapshot)), np.diff(offsets))
+    totals = np.bincount(rows, weights=values, minlength=len(snapshot))[rows]
+    shares = np.divide(values * 100, totals, out=np.zeros(len(values)), where=totals != 0)
+    return row_ids[rows], option_ids[ids], shares
+
+
+def _set_shifts(base, target, category, rows_base, rows_target, selected):
+    """Maiores mudanças de uma categoria por espécie selecionada
+
+    Retorna {id da espécie: [(opção, antes, depois, delta), ...]}, ordenado por |delta|.
+    """
+    table = CHAOS_COLUMNS[category]
+    options = {}
+    option_base = _union_ids(options, base.tables[table])
+    option_target = _union_ids(options, target.tables[table])
+    names = list(options)
+    stride = max(len(names), 1)
+
+    species_a, option_a, shares_a = _category_shares(base, category, rows_base, option_base)
+    species_b, option_b, shares_b = _category_shares(target, category, rows_target, option_target)
+    keys_a = species_a * stride + option_a
+    keys_b = species_b * stride + option_b
+
+    # Alinha os pares (espécie, opção) dos dois lados; quem falta em um lado vale 0
+    keys, inverse = np.unique(np.concatenate([keys_a, keys_b]), return_inverse=True)
+    before = np.bincount(inverse[:len(keys_a)], weights=shares_a, minlength=len(keys))
+    after = np.bincount(inverse[len(keys_a):], weights=shares_b, minlength=len(keys))
+    delta = after - before
+
+    species = keys // stride
+    keep = selected[species] & (np.abs(delta) >= DELTA_MIN_SHIFT)
+    keys, species, before, after, delta = keys[keep], species[keep], before[keep], after[keep], delta[keep]
+
+    # Top N por espécie: ordena por (espécie, -|delta|) e corta pela posição no grupo
+    order = np.lexsort((-np.abs(delta), species))
+    species = species[order]
+    position = np.arange(len(species)) - np.searchsorted(species, species)
+    order = order[position < DELTA_TOP_SHIFTS]
+
+    shifts = {}
+    for i in order:
+        shifts.setdefault(int(keys[i] // stride), []).append(
+            (names[keys[i] % stride], before[i], after[i], delta[i]))
+    return shifts
+
+
+def compute_meta_delta(base, target, top=DELTA_TOP_SPECIES, pokemon=None):
+    """Variação de `base` para `target` (ProcessedFormat): quem subiu, quem caiu e mudanças de set
+
+    Espécies e opções dos dois snapshots são alinhadas num espaço de ids comum, então as
+    diferenças saem de operações vetoriais. `pokemon` restringe as mudanças de set a uma espécie.
+    """
+    species = {}
+    rows_base = _row_species(base.snapshot, _union_ids(species, base.snapshot.tables['species']))
+    rows_target = _row_species(target.snapshot, _union_ids(species, target.snapshot.tables['species']))
+    names = list(species)
+
+    usage_base = np.zeros(len(names))
+    usage_target = np.zeros(len(names))
+    usage_base[rows_base] = np.frombuffer(base.snapshot.usage, dtype=np.float64) * 100
+    usage_target[rows_target] = np.frombuffer(target.snapshot.usage, dtype=np.float64) * 100
+    in_base = np.zeros(len(names), dtype=bool)
+    in_target = np.zeros(len(names), dtype=bool)
+    in_base[rows_base] = True
+    in_target[rows_target] = True
+    delta = usage_target - usage_base
+
+    def entry(i):
+        name = names[i]
+        return {
+            'name': name,
+            'sprite_name': get_sprite_name(name),
+            'usage': round(usage_target[i], 2) if in_target[i] else None,
+            'previous_usage': round(usage_base[i], 2) if in_base[i] else None,
+            'delta': round(delta[i], 2),
+            'rank': target.ranks.get(name),
+            'previous_rank': base.ranks.get(name),
+        }
+
+    risers = np.flatnonzero(delta > 0)
+    risers = risers[np.argsort(-delta[risers], kind='stable')[:top]]
+    fallers = np.flatnonzero(delta < 0)
+    fallers = fallers[np.argsort(delta[fallers], kind='stable')[:top]]
+
+    selected = in_base & in_target & (np.maximum(usage_base, usage_target) >= DELTA_MIN_USAGE)
+    if pokemon is not None:
+        only = np.zeros(len(names), dtype=bool)
+        only[species[pokemon]] = True
+        selected &= only
+
+    shifts = {}
+    for field, category in DELTA_SHIFT_FIELDS.items():
+        for i, changes in _set_shifts(base.snapshot, target.snapshot, category, rows_base, rows_target, selected).items():
+            shifts.setdefault(names[i], {})[field] = [
+                {'name': option, 'before': round(before, 2), 'after': round(after, 2), 'delta': round(change, 2)}
+                for option, before, after, change in changes
+            ]
+    for name, changes in shifts.items():
+        changes['usage_delta'] = round(delta[species[name]], 2)
+
+    return {
+        'risers': [entry(i) for i in risers],
+        'fallers': [entry(i) for i in fallers],
+        'shifts': shifts,
+    }
+
+
+# ==================== RESPOSTAS JSON ====================
+
+# Incrementar quando o formato das respostas mudar: invalida os ETags derivados da chave
+RESPONSE_FORMAT_VERSION = 1
+RESPONSE_MIN_COMPRESS_BYTES = 1024
+RESPONSE_IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+RESPONSE_REVALIDATE_CACHE = 'no-cache'
+
+_response_memory = LRUCache(RESPONSE_MEMORY_BUDGET)
+
+
+# ETags fortes precisam diferir por Content-Encoding: cada variante ganha um sufixo
+RESPONSE_ETAG_SUFFIXES = {'identity': '', 'gzip': '-gz', 'br': '-br'}
+
+
+def _key_etag(key):
+    return hashlib.sha1(repr((RESPONSE_FORMAT_VERSION, key)).encode('utf-8')).hexdigest()
+
+
+def _matching_etag(etag):
+    """Variante de `etag` (qualquer codificação) presente no If-None-Match, ou None
+
+    As variantes têm o mesmo conteúdo, então a cópia que o cliente tem continua válida.
+    """
+    for suffix in RESPONSE_ETAG_SUFFIXES.values():
+        if request.if_none_match.contains(etag + suffix):
+            return etag + suffix
+    return None
+
+
+def _not_modified(etag, cache_control):
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def encode_json_entry(data, etag=None, version=None):
+    """Serializa uma vez e guarda as variantes gzip/br junto com o ETag"""
+    body = app.json.dumps(data).encode('utf-8')
+    entry = {
+        'etag': etag or hashlib.sha1(body).hexdigest(),
+        'version': version,
+        'identity': body,
+    }
+    if len(body) >= RESPONSE_MIN_COMPRESS_BYTES:
+        entry['gzip'] = gzip.compress(body, compresslevel=6)
+        if brotli is not None:
+            entry['br'] = brotli.compress(body, quality=5)
+    entry['size'] = sum(len(entry[name]) for name in ('identity', 'gzip', 'br') if name in entry)
+    return entry
+
+
+def _send_json_entry(entry, cache_control):
+    matched = _matching_etag(entry['etag'])
+    if matched:
+        return _not_modified(matched, cache_control)
+
+    encoding = 'identity'
+    for candidate in ('br', 'gzip'):
+        if candidate in entry and request.accept_encodings[candidate]:
+            encoding = candidate
+            break
+    response = app.response_class(entry[encoding], mimetype='application/json')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(entry['etag'] + RESPONSE_ETAG_SUFFIXES[encoding])
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def json_response(key, build, immutable=False, version=None):
+    """Resposta JSON pré-serializada e comprimida, com ETag forte (por codificação) e 304 para If-None-Match
+
+    `key` identifica a resposta e `build()` devolve os dados (dict) ou uma resposta de erro,
+    que não é guardada. Respostas imutáveis têm ETag derivado só da chave: If-None-Match é
+    respondido sem montar nada. As demais ficam guardadas junto de `version` (o objeto de
+    origem, ou uma tupla deles) e são reaproveitadas enquanto ele for o mesmo.
+    """
+    if immutable:
+        matched = _matching_etag(_key_etag(key))
+        if matched:
+            return _not_modified(matched, RESPONSE_IMMUTABLE_CACHE)
+
+    entry = _response_memory.get(key)
+    # != compara tuplas elemento a elemento; objetos processados só são iguais a si mesmos
+    if entry is None or entry['version'] != version:
+        data = build()
+        if not isinstance(data, dict):
+            return data
+        entry = encode_json_entry(data, _key_etag(key) if immutable else None, version)
+        _response_memory.put(key, entry, entry['size'])
+
+    return _send_json_entry(entry, RESPONSE_IMMUTABLE_CACHE if immutable else RESPONSE_REVALIDATE_CACHE)
+
+
+def stats_json_response(key, meta, build):
+    """json_response para dados de stats; `build(processed)` recebe as stats de `meta`
+
+    Meses fechados são imutáveis. Nos demais casos as stats são carregadas (normalmente da
+    memória) e a resposta guardada vale enquanto o objeto processado for o mesmo.
+    """
+    if is_stats_immutable(meta):
+        return json_response(key, lambda: build(load_stats(meta)), immutable=True)
+    processed = load_stats(meta)
+    return json_response(key, lambda: build(processed), version=processed)
+
+
+# ==================== ANÁLISE DE TIMES ====================
+
+# Análises prontas valem por 30 dias. Um job 'running' sem resposta em ANALYSIS_JOB_TIMEOUT é
+# considerado perdido; um 'pending' espera esse tempo por rodada da fila à sua frente
+ANALYSIS_CACHE_TTL = 30 * 24 * 60 * 60
+ANALYSIS_JOB_TIMEOUT = 3 * 60
+ANALYSIS_ERROR_TTL = 60
+ANALYSIS_MAX_PENDING = 64
+ANALYSIS_LOCAL_DELAY = float(os.environ.get('POKESTATS_ANALYSIS_LOCAL_DELAY', '0.5'))
+
+# Limita as chamadas simultâneas ao LLM (por processo)
+analysis_executor = ThreadPoolExecutor(max_workers=ANALYSIS_CONCURRENCY, thread_name_prefix='team-analysis')
+_analysis_pending = set()
+_analysis_lock = threading.Lock()
+
+
+def normalize_analysis_team(team):
+    """Forma canônica do time: mesma equipe em outra ordem gera o mesmo job"""
+    normalized = []
+    for poke in team:
+        if not isinstance(poke, dict):
+            continue
+        moves = poke.get('moves')
+        normalized.append({
+            'name': str(poke.get('name') or 'Unknown'),
+            'tera_type': str(poke['tera_type']) if poke.get('tera_type') else None,
+            'moves': sorted(str(move) for move in (moves if isinstance(moves, list) else [])[:4]),
+        })
+    normalized.sort(key=lambda poke: (poke['name'], poke['tera_type'] or '', poke['moves']))
+    return normalized
+
+
+def analysis_job_id(format_code, team):
+    payload = json.dumps({'format': format_code, 'team': team}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def build_analysis_prompt(format_code, team):
+    team_desc = []
+    for poke in team:
+        desc = poke['name']
+        if poke['tera_type']:
+            desc += f" (Tera {poke['tera_type']})"
+        if poke['moves']:
+            desc += f" - Moves: {', '.join(poke['moves'])}"
+        team_desc.append(desc)
+
+    team_str = '\n'.join(team_desc)
+    is_vgc = 'vgc' in format_code.lower() or 'doubles' in format_code.lower()
+    format_type = "VGC (doubles)" if is_vgc else "Singles"
+
+    return f"""Você é um coach profissional de Pokemon competitivo.
+
+Analise este time de {format_type} ({format_code}) e explique como jogar com ele:
+
+{team_str}
+
+Forneça uma análise detalhada em português brasileiro incluindo:
+
+1. **Visão Geral do Time**: Qual é o arquétipo/estilo do time
+2. **Win Conditions**: Quais são as condições de vitória principais
+3. **Leads Recomendados**: Quais Pokemon devem começar na frente
+4. **Synergias Importantes**: Quais combinações funcionam bem
+5. **Ameaças e Counters**: Pokemon/estratégias perigosas e como lidar
+6. **Dicas de Gameplay**: Quando usar Tera, prioridade de knockouts
+7. **Matchups Difíceis**: Times que dão problema e como jogar contra
+
+Seja específico e prático."""
+
+
+def _gemini_analysis(prompt, format_code, team):
+    response = upstream.post(
+        f'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GEMINI_API_KEY}',
+        headers={'Content-Type': 'application/json'},
+        json={
+            'contents': [{'parts': [{'text': prompt}]}],
+            'generationConfig': {'temperature': 0.7, 'maxOutputTokens': 2048}
+        },
+        timeout=60
+    )
+    response.raise_for_status()
+    result = response.json()
+    return result['candidates'][0]['content']['parts'][0]['text']
+
+
+def _local_analysis(prompt, format_code, team):
+    """Substituto offline do LLM: latência configurável e texto determinístico"""
+    time.sleep(ANALYSIS_LOCAL_DELAY)
+    names = ', '.join(poke['name'] for poke in team)
+    leads = ' + '.join(poke['name'] for poke in team[:2])
+    return (
+        f"**Visão Geral do Time**: {names} ({format_code}).\n"
+        f"**Leads Recomendados**: {leads}.\n"
+        f"- Análise gerada pelo backend local (POKESTATS_ANALYSIS_BACKEND=local)."
+    )
+
+
+ANALYSIS_BACKENDS = {'gemini': _gemini_analysis, 'local': _local_analysis}
+
+
+def _save_analysis_job(job):
+    shared_cache.set(f"analysis:{job['job_id']}", json.dumps(job).encode('utf-8'))
+
+
+def get_analysis_job(job_id):
+    """Job salvo no cache compartilhado (visível para todos os workers) ou None"""
+    cached = shared_cache.get(f"analysis:{job_id}", ANALYSIS_CACHE_TTL)
+    if cached is None:
+        return None
+    job = json.loads(cached[0])
+    age = time.time() - cached[1]
+    timeout = ANALYSIS_JOB_TIMEOUT
+    if job['status'] == 'pending':
+        # Posição na fila ao enfileirar: cada rodada de ANALYSIS_CONCURRENCY jobs leva até um timeout
+        timeout *= -(-job.get('queued', 1) // ANALYSIS_CONCURRENCY)
+    if job['status'] in ('pending', 'running') and age > timeout:
+        job.update(status='error', error='Tempo esgotado')
+    return job
+
+
+def submit_team_analysis(format_code, team):
+    """Reaproveita a análise pronta ou em andamento; senão enfileira um job novo
+
+    Retorna o job (dict) ou None se a fila deste processo estiver cheia.
+    """
+    job_id = analysis_job_id(format_code, team)
+    job = get_analysis_job(job_id)
+    if job is not None:
+        stale_error = job['status'] == 'error' and time.time() - job.get('finished', 0) > ANALYSIS_ERROR_TTL
+        if not stale_error:
+            job['cached'] = job['status'] == 'done'
+            return job
+
+    queued = {'job_id': job_id, 'status': 'pending', 'format': format_code}
+    with _analysis_lock:
+        if job_id not in _analysis_pending:
+            if len(_analysis_pending) >= ANALYSIS_MAX_PENDING:
+                return None
+            _analysis_pending.add(job_id)
+            queued['queued'] = len(_analysis_pending)
+            _save_analysis_job(queued)
+            analysis_executor.submit(_run_team_analysis, job_id, format_code, team)
+    # Sem o SQLite (escrita falhou), responde com o job em memória
+    job = get_analysis_job(job_id) or queued
+    job['cached'] = False
+    return job
+
+
+def _run_team_analysis(job_id, format_code, team):
+    job = {'job_id': job_id, 'status': 'running', 'format': format_code}
+    try:
+        _save_analysis_job(job)
+        backend = ANALYSIS_BACKENDS[ANALYSIS_BACKEND]
+        job['analysis'] = backend(build_analysis_prompt(format_code, team), format_code, team)
+        job['status'] = 'done'
+    except Exception as e:
+        print(f"Erro ao analisar time {job_id}: {e}")
+        job.update(status='error', error=f'Erro ao analisar time: {str(e)}')
+    finally:
+        job['finished'] = time.time()
+        _save_analysis_job(job)
+        with _analysis_lock:
+            _analysis_pending.discard(job_id)
+
+
 # ==================== ROTAS ====================
 
 @app.route('/')
@@ -930,67 +3630,428 @@ def api_months():
 @app.route('/api/formats/<month>')
 def api_formats_for_month(month):
     """Lista formatos disponíveis em um mês"""
+    check_stats_params(month)
     formats = get_available_formats_for_month(month)
     return jsonify({'formats': formats})
 
 
-@app.route('/api/stats/<format_code>')
-def api_stats(format_code):
+@app.route('/api/availability')
+def api_availability():
+    """Matriz de disponibilidade: formato -> mês -> ratings"""
+    months = get_available_months()
+    return jsonify({
+        'months': months,
+        'formats': availability_index.matrix(),
+        'updated': availability_index.updated,
+    })
+
+
+MONTH_PATTERN = re.compile(r'\d{4}-\d{2}')
+RATING_PATTERN = re.compile(r'\d+')
+
+
+class InvalidStatsParams(ValueError):
+    """Mês ou rating fora do formato esperado (respondido com 400)"""
+
+
+def check_stats_params(month=None, rating=None):
+    """Valida mês (AAAA-MM) e rating (inteiro): ambos viram caminhos dentro de CACHE_DIR"""
+    if month is not None and not MONTH_PATTERN.fullmatch(month):
+        raise InvalidStatsParams(f'Mês inválido: {month}')
+    if rating is not None and not RATING_PATTERN.fullmatch(rating):
+        raise InvalidStatsParams(f'Rating inválido: {rating}')
+
+
+def requested_stats_meta(format_code):
+    """Fonte das stats pedida na query string (?source=replays&days= ou ?rating=&month=)
+
+    Retorna o dict `meta` das respostas, ou None se não houver mês disponível.
+    Levanta InvalidStatsParams para mês ou rating inválidos.
+    """
+    if request.args.get('source') == 'replays':
+        days = min(max(request.args.get('days', REPLAY_STATS_DEFAULT_DAYS, type=int), 1), REPLAY_STATS_MAX_DAYS)
+        return {'format': format_code, 'source': 'replays', 'days': days}
+
     rating = request.args.get('rating', '1760')
     month = request.args.get('month')
+    check_stats_params(month, rating)
 
     if not month:
         months = get_available_months()
         month = months[0] if months else None
 
     if not month:
-        return jsonify({'error': 'Nenhum mês disponível'}), 404
+        return None
 
-    raw_data = fetch_smogon_data(format_code, rating, month)
-    if not raw_data:
-        return jsonify({'error': f'Dados não encontrados para {format_code} rating {rating} em {month}'}), 404
+    return {'format': format_code, 'rating': rating, 'month': month}
 
-    data = process_pokemon_data(raw_data)
-    if not data:
-        return jsonify({'error': 'Erro ao processar dados'}), 500
 
-    data['meta'] = {'format': format_code, 'rating': rating, 'month': month}
-    return jsonify(data)
+def load_stats(meta):
+    """Stats processadas descritas por `meta` (ver requested_stats_meta) ou None"""
+    if meta.get('source') == 'replays':
+        return get_replay_stats(meta['format'], meta['days'])
+    return get_processed_stats(meta['format'], meta['rating'], meta['month'])
 
 
-@app.route('/api/pokemon/<format_code>/<pokemon_name>')
-def api_pokemon(format_code, pokemon_name):
-    rating = request.args.get('rating', '1760')
-    month = request.args.get('month')
+def is_stats_immutable(meta):
+    """Stats de um mês fechado do Smogon nunca mudam"""
+    return 'month' in meta and is_month_final(meta['month'])
+
+
+def load_requested_stats(format_code):
+    """Stats pedidas na query string; retorna (stats processadas ou None, meta)
+
+    meta é None se não houver mês disponível.
+    """
+    meta = requested_stats_meta(format_code)
+    if not meta:
+        return None, None
+    return load_stats(meta), meta
+
+
+# Downloads/processamentos simultâneos ao carregar vários ratings de um formato
+RATINGS_CONCURRENCY = 4
+RATINGS_MAX = 8
+ratings_executor = ThreadPoolExecutor(max_workers=RATINGS_CONCURRENCY, thread_name_prefix='ratings')
+
+
+def published_ratings(format_code, month):
+    """Ratings publicados para o formato no mês (ou os ratings padrão, se a listagem faltar)"""
+    ratings = availability_index.get_formats(month).get(format_code)
+    return [str(rating) for rating in (ratings or get_ratings_for_format(format_code))]
+
+
+def load_ratings_stats(format_code, month, ratings):
+    """Carrega as stats de vários ratings em paralelo: {rating: stats processadas ou None}
 
+    Cada rating passa pelo SingleFlight de get_processed_stats, então requisições simultâneas
+    continuam dividindo o mesmo download.
+    """
+    futures = {rating: ratings_executor.submit(get_processed_stats, format_code, rating, month) for rating in ratings}
+    results = {}
+    for rating, future in futures.items():
+        try:
+            results[rating] = future.result()
+        except Exception as e:
+            print(f"Erro ao carregar {format_code}-{rating} ({month}): {e}")
+            results[rating] = None
+    return results
+
+
+def merge_ratings(loaded):
+    """Visão por espécie do uso e rank em cada rating, ordenada pelo uso no rating mais alto"""
+    ratings = [rating for rating, processed in loaded.items() if processed]
+    merged = {}
+    for rating in ratings:
+        for entry in loaded[rating].ranked_list:
+            species = merged.get(entry['name'])
+            if species is None:
+                species = merged[entry['name']] = {
+                    'name': entry['name'],
+                    'sprite_name': entry['sprite_name'],
+                    'usage': dict.fromkeys(ratings),
+                    'rank': dict.fromkeys(ratings),
+                }
+            species['usage'][rating] = entry['usage']
+            species['rank'][rating] = entry['rank']
+
+    def sort_key(species):
+        return [-(species['usage'][rating] or 0) for rating in reversed(ratings)]
+
+    return sorted(merged.values(), key=sort_key)
+
+
+@app.route('/api/stats/<format_code>')
+def api_stats(format_code):
+    meta = requested_stats_meta(format_code)
+    if not meta:
+        return jsonify({'error': 'Nenhum mês disponível'}), 404
+
+    # ?view=summary: só o ranking; ?fields=moves,items: detalhes parciais; ?limit/?offset: paginação
+    summary = request.args.get('view') == 'summary'
+    fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()]
+    invalid = [field for field in fields if field not in POKEMON_FIELDS]
+    if invalid:
+        return jsonify({'error': f'Campos inválidos: {", ".join(invalid)}'}), 400
+    if fields and 'name' not in fields:
+        fields.insert(0, 'name')
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(limit, 0)
+
+    def build(processed):
+        if not processed:
+            if meta.get('source') == 'replays':
+                return jsonify({'error': f'Nenhum replay de {format_code} nos últimos {meta["days"]} dias'}), 404
+            return jsonify({'error': f'Dados não encontrados para {format_code} rating {meta["rating"]} em {meta["month"]}'}), 404
+        data = processed.to_dict(fields, offset, limit, summary)
+        data['meta'] = meta
+        return data
+
+    key = ('stats', tuple(meta.items()), tuple(fields), offset, limit, summary)
+    return stats_json_response(key, meta, build)
+
+
+@app.route('/api/stats/<format_code>/delta')
+def api_stats_delta(format_code):
+    """Variação entre dois meses ou ratings (?month=&rating= contra ?compare_month=&compare_rating=)
+
+    Sem compare_*, compara com o mês anterior no mesmo rating.
+    """
+    meta = requested_stats_meta(format_code)
+    if not meta:
+        return jsonify({'error': 'Nenhum mês disponível'}), 404
+    if meta.get('source') == 'replays':
+        return jsonify({'error': 'A comparação só está disponível para stats do Smogon'}), 400
+
+    compare_month = request.args.get('compare_month')
+    compare_rating = request.args.get('compare_rating', meta['rating'])
+    check_stats_params(compare_month, compare_rating)
+    if not compare_month:
+        if 'compare_rating' in request.args:
+            compare_month = meta['month']
+        else:
+            previous = [month for month in get_available_months() if month < meta['month']]
+            if not previous:
+                return jsonify({'error': f'Nenhum mês anterior a {meta["month"]}'}), 404
+            compare_month = previous[0]
+    base_meta = {'format': format_code, 'rating': compare_rating, 'month': compare_month}
+    if base_meta == meta:
+        return jsonify({'error': 'Informe um mês ou rating diferente para comparar'}), 400
+
+    top = min(max(request.args.get('limit', DELTA_TOP_SPECIES, type=int), 0), DELTA_MAX_SPECIES)
+    pokemon = request.args.get('pokemon')
+
+    def build(base, target):
+        for processed, source in ((base, base_meta), (target, meta)):
+            if not processed:
+                return jsonify({'error': f'Dados não encontrados para {format_code} rating {source["rating"]} em {source["month"]}'}), 404
+        name = None
+        if pokemon:
+            name = target.index.get(pokemon.lower()) or base.index.get(pokemon.lower())
+            if not name:
+                return jsonify({'error': 'Pokémon não encontrado'}), 404
+        data = compute_meta_delta(base, target, top, name)
+        data['meta'] = meta
+        data['compare'] = base_meta
+        return data
+
+    key = ('delta', tuple(base_meta.items()), tuple(meta.items()), top, pokemon and pokemon.lower())
+    if is_stats_immutable(meta) and is_stats_immutable(base_meta):
+        return json_response(key, lambda: build(load_stats(base_meta), load_stats(meta)), immutable=True)
+    base, target = load_stats(base_meta), load_stats(meta)
+    return json_response(key, lambda: build(base, target), version=(base, target))
+
+
+@app.route('/api/stats/<format_code>/ratings')
+def api_stats_ratings(format_code):
+    """Uso de cada Pokémon em todos os ratings do mês (?month=&ratings=0,1500,1760&limit=&offset=)"""
+    month = request.args.get('month')
+    check_stats_params(month)
     if not month:
         months = get_available_months()
         month = months[0] if months else None
-
     if not month:
         return jsonify({'error': 'Nenhum mês disponível'}), 404
 
-    raw_data = fetch_smogon_data(format_code, rating, month)
-    if not raw_data:
+    published = published_ratings(format_code, month)
+    ratings = {rating.strip() for rating in request.args.get('ratings', '').split(',') if rating.strip()}
+    if len(ratings) > RATINGS_MAX:
+        return jsonify({'error': f'Informe no máximo {RATINGS_MAX} ratings'}), 400
+    for rating in ratings:
+        check_stats_params(rating=rating)
+    # Só ratings publicados viram downloads no pool compartilhado; os demais vão para 'missing'
+    unpublished = sorted(ratings - set(published), key=int)
+    ratings = sorted(ratings & set(published) if ratings else published, key=int)
+    if not ratings:
+        return jsonify({'error': f'Nenhum dos ratings pedidos foi publicado para {format_code} em {month}',
+                        'missing': unpublished}), 404
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+    limit = max(limit, 0) if limit is not None else None
+
+    def build(loaded):
+        failed = [rating for rating, processed in loaded.items() if not processed]
+        if len(failed) == len(loaded):
+            return jsonify({'error': f'Dados não encontrados para {format_code} em {month}'}), 404
+        pokemon = merge_ratings(loaded)
+        end = None if limit is None else offset + limit
+        data = {
+            'format': format_code,
+            'month': month,
+            'ratings': [rating for rating in ratings if rating not in failed],
+            'missing': sorted(failed + unpublished, key=int),
+            'info': {rating: processed.info for rating, processed in loaded.items() if processed},
+            'pokemon': pokemon[offset:end],
+            'total': len(pokemon),
+        }
+        # Resposta parcial (algum rating falhou) não é guardada: a próxima requisição tenta de novo
+        return jsonify(data) if failed else data
+
+    key = ('ratings', format_code, month, tuple(ratings), tuple(unpublished), offset, limit)
+    if is_month_final(month):
+        return json_response(key, lambda: build(load_ratings_stats(format_code, month, ratings)), immutable=True)
+    loaded = load_ratings_stats(format_code, month, ratings)
+    return json_response(key, lambda: build(loaded), version=tuple(loaded.values()))
+
+
+@app.route('/api/pokemon/<format_code>/<pokemon_name>')
+def api_pokemon(format_code, pokemon_name):
+    meta = requested_stats_meta(format_code)
+    if not meta:
+        return jsonify({'error': 'Nenhum mês disponível'}), 404
+
+    def build(processed):
+        if not processed:
+            return jsonify({'error': 'Dados não encontrados'}), 404
+
+        pokemon_data = processed.get(pokemon_name)
+        if not pokemon_data:
+            return jsonify({'error': 'Pokémon não encontrado'}), 404
+
+        # Cópia rasa: os detalhes em cache são compartilhados entre requisições
+        pokemon_data = dict(pokemon_data)
+        pokemon_data['showdown_set'] = generate_showdown_set(pokemon_data, pokemon_data['name'])
+        pokemon_data['meta'] = meta
+        return pokemon_data
+
+    key = ('pokemon', tuple(meta.items()), pokemon_name.lower())
+    return stats_json_response(key, meta, build)
+
+
+@app.route('/api/trend/<format_code>/<pokemon_name>')
+def api_trend(format_code, pokemon_name):
+    """Uso, rank e top golpes/itens/Tera de um Pokémon nos últimos meses (?months=12&ratings=1500,1760)"""
+    months_count = min(max(request.args.get('months', HISTORY_MONTHS, type=int), 1), HISTORY_MAX_MONTHS)
+    ratings = [rating.strip() for rating in request.args.get('ratings', '').split(',') if rating.strip()]
+
+    try:
+        months = usage_history.recorded_months(format_code, ratings, months_count)
+        name, series = usage_history.trend(format_code, pokemon_name, months, ratings)
+    except sqlite3.Error as e:
+        print(f"Erro ao ler histórico: {e}")
+        return jsonify({'error': 'Histórico indisponível'}), 500
+
+    if not series:
+        return jsonify({'error': 'Sem histórico para este Pokémon'}), 404
+
+    return jsonify({'pokemon': name, 'format': format_code, 'months': months, 'series': series})
+
+
+@app.route('/api/team-coverage', methods=['POST'])
+def api_team_coverage():
+    """Cobertura de tipos de um time ({'team': [...]}) ou de um lote ({'teams': [[...], ...]})
+
+    Cada membro é uma lista de tipos ou {'types', 'tera_type', 'attack_types'};
+    com 'tera': true a Tera de cada membro é aplicada.
+    """
+    data = request.get_json(silent=True) or {}
+    batch = 'teams' in data
+    teams = data.get('teams') if batch else [data.get('team')]
+
+    if not isinstance(teams, list) or not teams:
+        return jsonify({'error': 'Informe "team" ou "teams"'}), 400
+    if len(teams) > TEAM_COVERAGE_MAX_TEAMS:
+        return jsonify({'error': f'Máximo de {TEAM_COVERAGE_MAX_TEAMS} times por requisição'}), 400
+
+    try:
+        defense, attack, present, members = encode_teams(teams, bool(data.get('tera')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    coverage = team_coverage(defense, attack, present)
+    results = [coverage_to_dict(coverage, i, team) for i, team in enumerate(members)]
+
+    if batch:
+        return jsonify({'teams': results})
+    return jsonify(results[0])
+
+
+@app.route('/api/search/<format_code>')
+def api_search(format_code):
+    """Autocomplete de espécies, golpes, itens e habilidades (?q=urshifu rapid&kinds=species,move)"""
+    query = request.args.get('q', '')
+    kinds = tuple(kind for kind in request.args.get('kinds', '').split(',') if kind in SEARCH_KINDS) or SEARCH_KINDS
+    limit = min(max(request.args.get('limit', SEARCH_LIMIT, type=int), 1), 50)
+
+    processed, meta = load_requested_stats(format_code)
+    if not meta:
+        return jsonify({'error': 'Nenhum mês disponível'}), 404
+    if not processed:
         return jsonify({'error': 'Dados não encontrados'}), 404
 
-    data = process_pokemon_data(raw_data)
-    if not data or 'pokemon' not in data:
-        return jsonify({'error': 'Erro ao processar dados'}), 500
+    results = processed.search_index().search(query, limit, kinds)
+    for result in results:
+        if result['kind'] == 'species':
+            entry = processed.ranked_list[processed.ranks[result['name']] - 1]
+            result.update(usage=entry['usage'], rank=entry['rank'], sprite_name=entry['sprite_name'])
+
+    return jsonify({'query': query, 'results': results, 'meta': meta})
 
-    pokemon_data = None
-    for name, poke_data in data['pokemon'].items():
-        if name.lower() == pokemon_name.lower():
-            pokemon_data = poke_data
-            break
 
-    if not pokemon_data:
-        return jsonify({'error': 'Pokémon não encontrado'}), 404
+@app.route('/api/checks/<format_code>')
+def api_checks(format_code):
+    """Quem verifica as ameaças (?threats=A,B, interseção) ou o que um Pokémon verifica (?checker=X)"""
+    threats = [name.strip() for name in request.args.get('threats', '').split(',') if name.strip()]
+    checker = request.args.get('checker', '').strip()
+    if bool(threats) == bool(checker):
+        return jsonify({'error': 'Informe "threats" ou "checker" (apenas um deles)'}), 400
 
-    pokemon_data['showdown_set'] = generate_showdown_set(pokemon_data, pokemon_data['name'])
-    pokemon_data['meta'] = {'format': format_code, 'rating': rating, 'month': month}
+    processed, meta = load_requested_stats(format_code)
+    if not meta:
+        return jsonify({'error': 'Nenhum mês disponível'}), 404
+    if not processed:
+        return jsonify({'error': 'Dados não encontrados'}), 404
+
+    limit = min(max(request.args.get('limit', CHECKS_QUERY_LIMIT, type=int), 1), 100)
+    names = threats or [checker]
+    resolved = [processed.resolve(name) for name in names]
+    missing = [name for name, found in zip(names, resolved) if not found]
+    if missing:
+        return jsonify({'error': f'Pokémon não encontrado: {", ".join(missing)}'}), 404
+
+    index = processed.checks_index()
+    if checker:
+        return jsonify({'checker': resolved[0], 'threats': index.checked_by(resolved[0], limit), 'meta': meta})
+
+    resolved = list(dict.fromkeys(resolved))
+    return jsonify({'threats': resolved, 'checks': index.checks_for(resolved, limit), 'meta': meta})
+
+
+@app.route('/api/team-builder/<format_code>')
+def api_team_builder(format_code):
+    """Sugere times completos a partir de 1 a 5 Pokémon fixos (?locked=A,B&checks_weight=0.5, de 0 a 10)"""
+    locked = [name.strip() for name in request.args.get('locked', '').split(',') if name.strip()]
+    if not 1 <= len(locked) <= TEAM_SIZE - 1:
+        return jsonify({'error': f'Informe de 1 a {TEAM_SIZE - 1} Pokémon em "locked"'}), 400
 
-    return jsonify(pokemon_data)
+    processed, meta = load_requested_stats(format_code)
+    if not meta:
+        return jsonify({'error': 'Nenhum mês disponível'}), 404
+    if not processed:
+        return jsonify({'error': 'Dados não encontrados'}), 404
+
+    resolved = [processed.resolve(name) for name in locked]
+    missing = [name for name, found in zip(locked, resolved) if not found]
+    if missing:
+        return jsonify({'error': f'Pokémon não encontrado: {", ".join(missing)}'}), 404
+    if len({_base_species(name) for name in resolved}) < len(resolved):
+        return jsonify({'error': 'Pokémon repetido no time'}), 400
+
+    checks_weight = request.args.get('checks_weight', TEAM_BUILDER_CHECKS_WEIGHT, type=float)
+    if not math.isfinite(checks_weight) or not 0 <= checks_weight <= TEAM_BUILDER_MAX_CHECKS_WEIGHT:
+        return jsonify({'error': f'checks_weight deve estar entre 0 e {TEAM_BUILDER_MAX_CHECKS_WEIGHT}'}), 400
+    started = time.perf_counter()
+    teams, truncated = processed.team_builder().suggest(resolved, checks_weight=checks_weight)
+
+    return jsonify({
+        'locked': resolved,
+        'teams': teams,
+        'truncated': truncated,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        'meta': meta,
+    })
 
 
 # ==================== API REPLAYS ====================
@@ -999,7 +4060,15 @@ def api_pokemon(format_code, pokemon_name):
 def api_replays(format_code):
     """Busca replays de um formato"""
     page = request.args.get('page', 1, type=int)
-    replays = fetch_replays(format_code, page)
+
+    # O armazém local é usado quando a ingestão do formato está em dia
+    state = replay_warehouse.get_state(format_code)
+    replays = None
+    if state['updated'] and time.time() - state['updated'] < REPLAY_WAREHOUSE_FRESHNESS:
+        replays = replay_warehouse.list_replays(format_code, page) or None
+
+    if replays is None:
+        replays = fetch_replays(format_code, page)
 
     if isinstance(replays, list):
         replays = replays[:20]
@@ -1007,21 +4076,20 @@ def api_replays(format_code):
     return jsonify({'replays': replays, 'format': format_code, 'page': page})
 
 
-@app.route('/api/replay/<replay_id>')
-def api_replay_detail(replay_id):
-    """Busca detalhes de um replay com times parseados"""
+def build_replay_detail(replay_id):
+    """Detalhes de um replay com times parseados e exportações (None se não encontrado)"""
     replay = fetch_replay_detail(replay_id)
 
     if not replay:
-        return jsonify({'error': 'Replay não encontrado'}), 404
+        return None
 
-    log = replay.get('log', '')
-    team1 = parse_team_from_log(log, 1)
-    team2 = parse_team_from_log(log, 2)
+    teams = parse_battle_log(replay.get('log', ''))
+    team1 = teams[1]
+    team2 = teams[2]
     export1 = generate_team_export(team1)
     export2 = generate_team_export(team2)
 
-    return jsonify({
+    return {
         'id': replay.get('id'),
         'format': replay.get('format'),
         'players': replay.get('players', []),
@@ -1036,69 +4104,123 @@ def api_replay_detail(replay_id):
         'export1': export1,
         'export2': export2,
         'replay_url': f"https://replay.pokemonshowdown.com/{replay_id}"
-    })
+    }
+
+
+@app.route('/api/replay/<replay_id>')
+def api_replay_detail(replay_id):
+    """Busca detalhes de um replay com times parseados"""
+    if not is_valid_replay_id(replay_id):
+        return jsonify({'error': 'Id de replay inválido'}), 400
+
+    def build():
+        detail = build_replay_detail(replay_id)
+        if not detail:
+            return jsonify({'error': 'Replay não encontrado'}), 404
+        return detail
+
+    # Um replay publicado não muda (exceto o contador de views)
+    return json_response(('replay', replay_id), build, immutable=True)
+
+
+REPLAY_BATCH_LIMIT = 50
+replay_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='replay-batch')
+
+
+@app.route('/api/replays/batch', methods=['GET', 'POST'])
+def api_replays_batch():
+    """Busca detalhes de vários replays em paralelo (lista de ids ou formato + página)
+
+    GET: ?ids=a,b ou ?format=&page=. POST: {"ids": [...]}, {"format": ..., "page": ...}
+    ou uma lista de ids.
+    """
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        if isinstance(body, list):
+            body = {'ids': body}
+        elif not isinstance(body, dict):
+            body = {}
+        replay_ids = body.get('ids', [])
+        format_code = body.get('format')
+        page = body.get('page', 1)
+    else:
+        replay_ids = [rid for rid in request.args.get('ids', '').split(',') if rid]
+        format_code = request.args.get('format')
+        page = request.args.get('page', 1, type=int)
+
+    if not replay_ids and isinstance(format_code, str) and format_code:
+        try:
+            page = int(page)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Página inválida'}), 400
+        replays = fetch_replays(format_code, page)
+        if isinstance(replays, list):
+            replay_ids = [replay.get('id') for replay in replays[:20] if replay.get('id')]
+
+    if not isinstance(replay_ids, list) or not replay_ids:
+        return jsonify({'error': 'Nenhum replay informado'}), 400
+    replay_ids = list(dict.fromkeys(str(rid) for rid in replay_ids))[:REPLAY_BATCH_LIMIT]
+    invalid = [rid for rid in replay_ids if not is_valid_replay_id(rid)]
+    replay_ids = [rid for rid in replay_ids if is_valid_replay_id(rid)]
+    if not replay_ids:
+        return jsonify({'error': 'Nenhum id de replay válido', 'invalid': invalid}), 400
+
+    details = replay_executor.map(build_replay_detail, replay_ids)
+    replays = []
+    missing = []
+    for replay_id, detail in zip(replay_ids, details):
+        if detail:
+            replays.append(detail)
+        else:
+            missing.append(replay_id)
+
+    return jsonify({'replays': replays, 'missing': missing, 'invalid': invalid})
 
 
 @app.route('/api/analyze-team', methods=['POST'])
 def api_analyze_team():
-    """Analisa um time e dá dicas de como jogar"""
-    if not GEMINI_API_KEY:
+    """Inicia (ou reaproveita) a análise de um time; o resultado é consultado por job_id"""
+    if ANALYSIS_BACKEND not in ANALYSIS_BACKENDS:
+        return jsonify({'error': f'Backend de análise desconhecido: {ANALYSIS_BACKEND}'}), 400
+    if ANALYSIS_BACKEND == 'gemini' and not GEMINI_API_KEY:
         return jsonify({'error': 'API key não configurada. Adicione GEMINI_API_KEY nas variáveis de ambiente.'}), 400
 
-    data = request.json
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Corpo deve ser um objeto JSON com "team"'}), 400
     team = data.get('team', [])
     format_code = data.get('format', 'gen9vgc2026regf')
 
+    if not isinstance(format_code, str) or not format_code:
+        return jsonify({'error': 'Formato inválido'}), 400
+    if not isinstance(team, list) or not all(isinstance(poke, dict) for poke in team):
+        return jsonify({'error': '"team" deve ser uma lista de Pokémon'}), 400
+    if len(team) > TEAM_SIZE:
+        return jsonify({'error': f'O time tem no máximo {TEAM_SIZE} Pokémon'}), 400
+    team = normalize_analysis_team(team)
     if not team:
         return jsonify({'error': 'Time vazio'}), 400
 
-    team_desc = []
-    for poke in team:
-        desc = poke.get('name', 'Unknown')
-        if poke.get('tera_type'):
-            desc += f" (Tera {poke['tera_type']})"
-        if poke.get('moves'):
-            desc += f" - Moves: {', '.join(poke['moves'][:4])}"
-        team_desc.append(desc)
-
-    team_str = '\n'.join(team_desc)
-    is_vgc = 'vgc' in format_code.lower() or 'doubles' in format_code.lower()
-    format_type = "VGC (doubles)" if is_vgc else "Singles"
+    job = submit_team_analysis(format_code, team)
+    if job is None:
+        return jsonify({'error': 'Muitas análises na fila, tente novamente em instantes'}), 503
 
-    prompt = f"""Você é um coach profissional de Pokemon competitivo.
+    status = 200 if job['status'] in ('done', 'error') else 202
+    return jsonify(job), status
 
-Analise este time de {format_type} ({format_code}) e explique como jogar com ele:
 
-{team_str}
+@app.route('/api/analyze-team/<job_id>')
+def api_analyze_team_status(job_id):
+    """Estado de uma análise: pending, running, done (com 'analysis') ou error"""
+    job = get_analysis_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Análise não encontrada'}), 404
+    return jsonify(job)
 
-Forneça uma análise detalhada em português brasileiro incluindo:
 
-1. **Visão Geral do Time**: Qual é o arquétipo/estilo do time
-2. **Win Conditions**: Quais são as condições de vitória principais
-3. **Leads Recomendados**: Quais Pokemon devem começar na frente
-4. **Synergias Importantes**: Quais combinações funcionam bem
-5. **Ameaças e Counters**: Pokemon/estratégias perigosas e como lidar
-6. **Dicas de Gameplay**: Quando usar Tera, prioridade de knockouts
-7. **Matchups Difíceis**: Times que dão problema e como jogar contra
-
-Seja específico e prático."""
-
-    try:
-        response = requests.post(
-            f'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GEMINI_API_KEY}',
-            headers={'Content-Type': 'application/json'},
-            json={
-                'contents': [{'parts': [{'text': prompt}]}],
-                'generationConfig': {'temperature': 0.7, 'maxOutputTokens': 2048}
-            },
-            timeout=60
-        )
-        response.raise_for_status()
-        result = response.json()
-        content = result['candidates'][0]['content']['parts'][0]['text']
-        return jsonify({'analysis': content, 'format': format_code})
-    except Exception as e:
-        return jsonify({'error': f'Erro ao analisar time: {str(e)}'}), 500
+@app.errorhandler(InvalidStatsParams)
+def invalid_stats_params(e):
+    return jsonify({'error': str(e)}), 400
 
 
 @app.errorhandler(404)
@@ -0,0 +1,118 @@
+"""
+PokeStatsBR - Benchmarks
+Mede o desempenho das partes críticas do app sem acessar a rede
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+
+from app import (
+    parse_battle_log, process_pokemon_data, ChaosSnapshot, save_snapshot_file, load_snapshot_file
+)
+
+SPECIES = [
+    ('Incineroar', 'Intimidate', 'Sitrus Berry', ['Fake Out', 'Flare Blitz', 'Parting Shot', 'Knock Off']),
+    ('Flutter Mane', 'Protosynthesis', 'Booster Energy', ['Moonblast', 'Shadow Ball', 'Protect', 'Icy Wind']),
+    ('Urshifu-Rapid-Strike', 'Unseen Fist', 'Mystic Water', ['Surging Strikes', 'Close Combat', 'Aqua Jet', 'Detect']),
+    ('Amoonguss', 'Regenerator', 'Rocky Helmet', ['Spore', 'Rage Powder', 'Pollen Puff', 'Protect']),
+    ('Rillaboom', 'Grassy Surge', 'Assault Vest', ['Grassy Glide', 'Wood Hammer', 'Fake Out', 'U-turn']),
+    ('Chien-Pao', 'Sword of Ruin', 'Focus Sash', ['Icicle Crash', 'Sucker Punch', 'Sacred Sword', 'Protect']),
+    ('Landorus-Therian', 'Intimidate', 'Choice Scarf', ['Stomping Tantrum', 'Rock Slide', 'U-turn', 'Stone Edge']),
+    ('Tornadus', 'Prankster', 'Covert Cloak', ['Tailwind', 'Bleakwind Storm', 'Rain Dance', 'Protect']),
+]
+
+
+def make_log(turns=20, seed=0):
+    """Gera um log sintético de batalha em dupla com o protocolo do Showdown"""
+    rnd = random.Random(seed)
+    lines = ['|player|p1|Alice|1|1500', '|player|p2|Bob|2|1500', '|gametype|doubles']
+    teams = {'p1': rnd.sample(SPECIES, 6), 'p2': rnd.sample(SPECIES, 6)}
+    for side, team in teams.items():
+        for species, _, _, _ in team:
+            lines.append(f'|poke|{side}|{species.split("-")[0] if "Urshifu" in species else species}, L50|')
+    lines.append('|start')
+    for side, team in teams.items():
+        for slot, (species, ability, item, _) in zip('ab', team):
+            lines.append(f'|switch|{side}{slot}: Nick {species[:4]}|{species}, L50|100/100')
+            lines.append(f'|-ability|{side}{slot}: Nick {species[:4]}|{ability}')
+    for turn in range(1, turns + 1):
+        lines.append(f'|turn|{turn}')
+        for side, team in teams.items():
+            for slot, (species, _, item, moves) in zip('ab', team):
+                lines.append(f'|move|{side}{slot}: Nick {species[:4]}|{rnd.choice(moves)}|p1a: Target')
+                lines.append(f'|-damage|{side}{slot}: Nick {species[:4]}|{rnd.randint(1, 99)}/100')
+                if rnd.random() < 0.1:
+                    lines.append(f'|-enditem|{side}{slot}: Nick {species[:4]}|{item}')
+        lines.append('|upkeep')
+    lines.append('|win|Alice')
+    return '\n'.join(lines)
+
+
+def bench_parse_log(count=2000):
+    logs = [make_log(seed=seed) for seed in range(count)]
+    total_bytes = sum(len(log) for log in logs)
+    start = time.perf_counter()
+    for log in logs:
+        parse_battle_log(log)
+    elapsed = time.perf_counter() - start
+    print(f"parse_battle_log: {count} replays em {elapsed:.3f}s "
+          f"({count / elapsed:.0f} replays/s, {total_bytes / elapsed / 1e6:.1f} MB/s)")
+
+
+def make_chaos(species=400, seed=0):
+    """Gera um JSON chaos sintético com a estrutura do Smogon"""
+    rnd = random.Random(seed)
+    names = [f'Mon{i}' for i in range(species)]
+    data = {}
+    for name in names:
+        data[name] = {
+            'usage': rnd.random() * 0.5,
+            'Raw count': rnd.randint(1, 100000),
+            'Viability Ceiling': [1, 90, 80, 70],
+            'Abilities': {f'ability{i}': rnd.random() * 1000 for i in range(3)},
+            'Items': {f'item{i}': rnd.random() * 1000 for i in range(40)},
+            'Moves': {f'move{i}': rnd.random() * 1000 for i in range(60)},
+            'Spreads': {f'Adamant:{rnd.randint(0, 252)}/252/0/0/4/{i}': rnd.random() for i in range(200)},
+            'Teammates': {mate: rnd.random() - 0.2 for mate in rnd.sample(names, 60)},
+            'Checks and Counters': {mate: [rnd.random() * 100, rnd.random() * 100, rnd.random()]
+                                    for mate in rnd.sample(names, 30)},
+            'Tera Types': {'fire': rnd.random(), 'water': rnd.random()},
+            'Happiness': {'255.0': 1.0},
+        }
+    return {'info': {'metagame': 'bench', 'number of battles': 123456}, 'data': data}
+
+
+def bench_snapshot_load(species=400):
+    text = json.dumps(make_chaos(species))
+    start = time.perf_counter()
+    processed = process_pokemon_data(json.loads(text))
+    from_json = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.snap')
+        save_snapshot_file(path, processed.snapshot, time.time())
+        start = time.perf_counter()
+        snapshot, _ = load_snapshot_file(path)
+        process_pokemon_data(snapshot)
+        from_file = time.perf_counter() - start
+        size = os.path.getsize(path)
+        del snapshot
+
+    print(f"snapshot: JSON ({len(text) / 1e6:.1f} MB) + processamento {from_json * 1000:.0f}ms, "
+          f"arquivo .snap ({size / 1e6:.1f} MB) {from_file * 1000:.1f}ms")
+
+
+BENCHMARKS = {
+    'parse-log': bench_parse_log,
+    'snapshot-load': bench_snapshot_load,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
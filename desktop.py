@@ -7,6 +7,7 @@ import sys
 import os
 import threading
 import webbrowser
+import multiprocessing
 
 # Adicionar diretório atual ao path
 if getattr(sys, 'frozen', False):
@@ -18,6 +19,8 @@ else:
 
 # Configurar variáveis de ambiente antes de importar Flask
 os.environ['FLASK_ENV'] = 'production'
+# Cache (e espelho offline do Smogon) ao lado do executável, fora da pasta temporária do PyInstaller
+os.environ.setdefault('POKESTATS_CACHE_DIR', os.path.join(application_path, 'cache'))
 
 def run_flask():
     """Inicia o servidor Flask em background"""
@@ -80,4 +83,11 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
+    # Necessário no executável: os workers do pool de stats reexecutam o binário
+    multiprocessing.freeze_support()
+    if '--mirror' in sys.argv:
+        # Baixa o último mês dos formatos do app para usar offline (ex.: em torneios)
+        from app import mirror_stats, scrape_available_months
+        mirror_stats(scrape_available_months()[:1])
+    else:
+        main()